@@ -0,0 +1,187 @@
+import numpy as np
+
+import cv_gui.utils.flags as cv_gui
+from cv_gui.utils.frame_cache import FrameCache
+from cv_gui.dataset_handlers.frame import LazyFrame
+
+# Setters of the wrapped cameras that change the frames they return, the cached frames are dropped when one is called
+FRAME_SETTERS = ("set_decode_scale", "set_lazy_frames", "set_color_format", "set_preview_resolution", "set_rectifier",
+                 "enable_rectification", "close_rectifier", "set_label_folder", "set_prefetch_measures", "set_runtime_parameters")
+
+
+class CachedCamera:
+    """Sits between Process and a camera (DatasetLoader, ZED, ...) and serves recently decoded frames from memory.
+    
+    Every attribute that is not defined here is forwarded to the wrapped camera. Calling one of FRAME_SETTERS
+    through it clears the cache.
+    """
+    def __init__(self, camera, max_bytes = 512 * 1024 * 1024):
+        self.camera = camera
+        self.frame_cache = FrameCache(max_bytes=max_bytes)
+        
+        self.idx = getattr(camera, "idx", 0)
+        
+        # False when the wrapped camera is not positioned at self.idx anymore
+        self.camera_in_sync = True
+        
+        # (key, LazyFrame) cached once the next frame is requested, with the values that were read from it by then
+        self.pending_frame = None
+        
+    @staticmethod
+    def _freeze(value):
+        # Cached arrays are copies nobody else holds, read-only so they can not be drawn on by mistake
+        if(isinstance(value, np.ndarray)):
+            value = value.copy()
+            value.setflags(write=False)
+            
+        return value
+    
+    @staticmethod
+    def _copy_arrays(values):
+        return {key: value.copy() if isinstance(value, np.ndarray) else value for key, value in values.items()}
+    
+    @classmethod
+    def _thaw(cls, data):
+        # A hit gets arrays of its own, the callbacks may draw on them
+        if(not isinstance(data, LazyFrame)):
+            return cls._copy_arrays(data)
+        
+        with data.lock:
+            frame = LazyFrame(cls._copy_arrays(data.values))
+            frame.volatile = data.volatile
+            groups = {keys: producer for key, (keys, producer) in data.producers.items() if key not in data.values}
+            
+        for keys, producer in groups.items():
+            frame.set_producer(keys, lambda producer = producer: cls._copy_arrays(producer()))
+            
+        return frame
+        
+    def __getattr__(self, name):
+        attr = getattr(self.camera, name)
+        if(name not in FRAME_SETTERS):
+            return attr
+        
+        def setter(*args, **kwargs):
+            self.clear_cache()
+            return attr(*args, **kwargs)
+        
+        return setter
+    
+    def init(self):
+        self.camera.init()
+        
+        self.frame_cache.clear()
+        self.idx = self.camera.idx
+        self.camera_in_sync = True
+        
+    def get_next_stereo_images(self, gray = True, color = True):
+        self._cache_pending_frame()
+        key = (self.idx, gray, color)
+        
+        data = self.frame_cache.get(key)
+        if(data is not None):
+            self.idx = self.camera.get_next_index(self.idx)
+            self.camera_in_sync = False
+            return cv_gui.ERROR.SUCCESS, self._thaw(data)
+        
+        # Seek the camera only when it actually has to decode
+        if(not self.camera_in_sync):
+            self.camera.jump_to(self.idx)
+            self.camera_in_sync = True
+            
+        status, data = self.camera.get_next_stereo_images(gray = gray, color = color)
+        
+        if(status == cv_gui.ERROR.SUCCESS):
+            if(isinstance(data, LazyFrame)):
+                data, cached_frame = self._track_lazy_frame(data)
+                self.pending_frame = (key, cached_frame)
+            else:
+                self.frame_cache.put(key, self._own_frame(data))
+            self.idx = self.camera.idx
+            
+        return status, data
+    
+    def _cache_pending_frame(self):
+        if(self.pending_frame is not None):
+            key, frame = self.pending_frame
+            self.frame_cache.put(key, frame)
+            self.pending_frame = None
+            
+    def _track_lazy_frame(self, data):
+        """Frame to return for the LazyFrame `data` of the camera, and the LazyFrame to cache for it.
+        
+        `data` itself is kept away from the caller, its values are replaced with read-only snapshots that
+        are shared with the cached frame. Values the producers derive from others (e.g. gray from colour)
+        never read what a callback drew, and the producers the cached frame keeps only pin arrays that
+        the cache counts. Producers of a volatile frame would read the next grab, the cached frame does
+        not keep those.
+        """
+        frame = LazyFrame()
+        frame.volatile = data.volatile
+        cached_frame = LazyFrame()
+        
+        with data.lock:
+            for key, value in data.loaded_items():
+                frame[key] = value
+                if(key != "buffer_set"):
+                    cached_frame[key] = data.values[key] = self._freeze(value)
+                    
+            groups = {keys: producer for keys, producer in data.producers.values()}
+            
+        def snapshot(keys):
+            # (values, snapshots) of keys, produced once by `data`
+            with data.lock:
+                values = {key: data[key] for key in keys}
+                snapshots = {}
+                for key, value in values.items():
+                    snapshots[key] = cached_frame.values[key] if cached_frame.is_loaded(key) else self._freeze(value)
+                    data.values[key] = snapshots[key]
+                    cached_frame[key] = snapshots[key]
+                    
+            return values, snapshots
+        
+        for keys in groups:
+            def produce(keys = keys):
+                # The caller gets the produced arrays, or copies of the snapshots if they were produced for the cache first
+                values, snapshots = snapshot(keys)
+                return {key: value.copy() if value is snapshots[key] and isinstance(value, np.ndarray) else value
+                        for key, value in values.items()}
+            
+            frame.set_producer(keys, produce)
+            if(not data.volatile):
+                cached_frame.set_producer(keys, lambda keys = keys: snapshot(keys)[1])
+                
+        return frame, cached_frame
+    
+    def _own_frame(self, data):
+        # Arrays that are views on camera buffers (e.g. sl.Mat.get_data()) get overwritten by the next grab.
+        # The cached copy does not hold the camera buffers
+        return {key: self._freeze(value) for key, value in data.items() if key != "buffer_set"}
+    
+    def jump_to(self, frame_number):
+        self._cache_pending_frame()
+        
+        # The wrapped camera is only seeked on the next cache miss
+        self.idx = frame_number
+        self.camera_in_sync = False
+        
+        # Cache hits advance through the plan of the wrapped camera as well
+        self.camera.seek_frame_plan(frame_number)
+        
+    def set_recording(self, recording):
+        # Frames cached at the preview resolution must not be recorded
+        if(recording != self.camera.recording):
+            self.clear_cache()
+        self.camera.set_recording(recording)
+        
+    def clear_cache(self):
+        self.pending_frame = None
+        self.frame_cache.clear()
+        
+    def get_cache_stats(self):
+        return self.frame_cache.get_stats()
+    
+    def close(self):
+        self.pending_frame = None
+        self.frame_cache.clear()
+        self.camera.close()
@@ -2,12 +2,34 @@ import os
 import cv2 as cv
 import numpy as np
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
 from cv_gui.dataset_handlers.stereo_camera import StereoCamera
+from cv_gui.dataset_handlers.prefetcher import FramePrefetcher
+from cv_gui.dataset_handlers.sequence_index import get_sequence_index
+from cv_gui.dataset_handlers.proxy_cache import ProxyCache
+from cv_gui.dataset_handlers.rectifier import StereoRectifier
+from cv_gui.dataset_handlers.frame import LazyFrame
 import cv_gui.utils.flags as cv_gui
 
+# imread flags for each supported decode scale
+COLOR_DECODE_FLAGS = {1: cv.IMREAD_COLOR, 2: cv.IMREAD_REDUCED_COLOR_2, 4: cv.IMREAD_REDUCED_COLOR_4, 8: cv.IMREAD_REDUCED_COLOR_8}
+GRAY_DECODE_FLAGS = {1: cv.IMREAD_GRAYSCALE, 2: cv.IMREAD_REDUCED_GRAYSCALE_2, 4: cv.IMREAD_REDUCED_GRAYSCALE_4, 8: cv.IMREAD_REDUCED_GRAYSCALE_8}
+
+def invert_poses(poses):
+    # Closed form inverse of a stack of SE(3) matrices: [R t]^-1 = [R^T -R^T t]
+    R_inv = np.swapaxes(poses[..., :3, :3], -1, -2)
+    
+    inv_poses = np.zeros_like(poses)
+    inv_poses[..., :3, :3] = R_inv
+    inv_poses[..., :3, 3] = -(R_inv @ poses[..., :3, 3:4])[..., 0]
+    inv_poses[..., 3, 3] = 1.0
+    
+    return inv_poses
+
 class DatasetLoader(StereoCamera):
     def __init__(self, left_path = "", right_path = "", label_path = "", dataset_type = cv_gui.DATASET_TYPE.KITTI, pose_file = "", timestamp_file = "", 
-                 calib_file = "", gray = True, color = True):
+                 calib_file = "", gray = True, color = True, prefetch = 0, prefetch_workers = 4, decode_scale = 1,
+                 use_sequence_index = False):
         super().__init__(dataset=dataset_type)
         
         self.dataset_type = dataset_type
@@ -22,8 +44,25 @@ class DatasetLoader(StereoCamera):
         self.gray = gray
         self.color = color
         
+        # Images are decoded at 1/decode_scale of their resolution (1, 2, 4 or 8)
+        assert decode_scale in COLOR_DECODE_FLAGS, "decode_scale should be 1, 2, 4 or 8"
+        self.decode_scale = decode_scale
+        
         self.initial_pose = None
         self.idx = 0
+        
+        # Opt-in sidecar index of the left images folder, it also keeps the parsed timestamps and poses.
+        # It is written next to the folder, which must be writable for it to help
+        self.use_sequence_index = use_sequence_index
+        self.sequence_index = None
+        
+        # Read-ahead of the next `prefetch` frames. 0 disables it
+        self.prefetch = prefetch
+        self.prefetch_workers = prefetch_workers
+        self.prefetcher = None
+        
+        # Threads used to decode the frames of a batch
+        self.batch_workers = prefetch_workers
 
     def set_left_folder(self, path):
         self.left_path = path
@@ -42,6 +81,17 @@ class DatasetLoader(StereoCamera):
         
     def set_pose_file_path(self, path):
         self.pose_file = path
+        
+    def set_decode_scale(self, decode_scale):
+        assert decode_scale in COLOR_DECODE_FLAGS, "decode_scale should be 1, 2, 4 or 8"
+        self.decode_scale = decode_scale
+        
+        if(self.prefetcher is not None):
+            self.prefetcher.clear()
+            
+        # Keep the intrinsics in line with the decoded resolution
+        if(self.base_camera_type is not None):
+            self.set_base_camera_type_for_intrinsics(self.base_camera_type)
 
     def init(self):
         if(self.dataset_type == cv_gui.DATASET_TYPE.KITTI):
@@ -49,13 +99,18 @@ class DatasetLoader(StereoCamera):
             right_img_folder = self.right_path
             label_img_foler = self.label_path
 
-            self.left_img_files = self.get_img_files_from_dir(left_img_folder)
+            if(self.use_sequence_index):
+                self.sequence_index = get_sequence_index(left_img_folder)
+                self.left_img_files = self.sequence_index.get_img_files()
+                self.img_shape = self.sequence_index.img_shape
+            else:
+                self.left_img_files = self.get_img_files_from_dir(left_img_folder)
             self.right_img_files = self.get_img_files_from_dir(right_img_folder)
 
             self.img_count = len(self.left_img_files)
             # Read timestamps
             if(self.timestamp_file):
-                self.timestamps = self._load_timestamps(self.timestamp_file)
+                self.timestamps = self._load_sequence_array("timestamps", self.timestamp_file, self._load_timestamps)
                 
             # Load calibration params
             if(self.calib_file):
@@ -68,96 +123,208 @@ class DatasetLoader(StereoCamera):
             # Read poses
             if(self.pose_file):
                 self.poses, self.poses_right_cam = self._load_poses(self.pose_file)
+                self.rel_poses = self._get_relative_poses(self.poses)
+                self.rel_poses_right_cam = self._get_relative_poses(self.poses_right_cam)
                 self.initial_pose = self.poses[self.idx]
                 self.initial_pose_right = self.poses_right_cam[self.idx]
                 
             # Load Label Files
             if(self.label_path):  
                 self.label_img_files = self.get_img_files_from_dir(label_img_foler)
+                
+            # Keep the parsed timestamps and poses for the next start
+            if(self.sequence_index is not None and self.sequence_index.modified):
+                self.sequence_index.save()
+                
+            if(self.prefetch > 0):
+                self.set_prefetch(self.prefetch, self.prefetch_workers)
 
-    def get_img_files_from_dir(self, dir):
-        files = os.listdir(dir)
-        img_files = [(dir +'/'+ ff) for ff in files if (ff.endswith('.png') or ff.endswith('.jpg') or ff.endswith('.jpeg'))]
-        img_files.sort()
+    def set_prefetch(self, prefetch, num_workers = 4):
+        if(self.prefetcher is not None):
+            self.prefetcher.close()
+            self.prefetcher = None
+            
+        self.prefetch = prefetch
+        self.prefetch_workers = num_workers
+        if(prefetch > 0):
+            self.prefetcher = FramePrefetcher(self._read_frame, depth=prefetch, num_workers=num_workers)
 
-        return img_files
+    def enable_proxies(self, levels = (2, 4), preview_level = 2, proxy_dir = ""):
+        # Generate the proxies of the whole sequence in the background, straight from reduced decodes
+        if(proxy_dir == ""):
+            proxy_dir = os.path.normpath(self.left_path) + ".proxies"
+            
+        self.close_proxies()
+        self.proxy_cache = ProxyCache(proxy_dir, levels = levels, preview_level = preview_level)
+        self.proxy_cache.generate(lambda idx, level: self._read_frame(idx, decode_scale = level), range(self.img_count))
+        
+    def get_proxy_frame(self, frame_number):
+        data = super().get_proxy_frame(frame_number)
+        
+        if(data is not None and self.timestamp_file):
+            data["t"] = self.timestamps[frame_number]
+            
+        return data
+    
+    def _read_proxy_label_img(self, frame_number):
+        if(not self.label_path):
+            return None
+        
+        return self._read_label_img(frame_number, 1, None)
+    
+    def _load_sequence_array(self, name, source_file, loader):
+        if(self.sequence_index is None):
+            return loader(source_file)
+        
+        return self.sequence_index.get_array(name, source_file, loader)
     
     def _load_poses(self, pose_file):
         """Load ground truth poses (T_w_cam0) from file."""
+        poses = self._load_sequence_array("poses", pose_file, self._read_poses)
+        if(len(poses) == 0):
+            return poses, np.empty((0, 4, 4))
+
+        # The transformation of right camera w.r.t left camera
+        R = self.cam_parameters[cv_gui.CAMERA_TYPE.RIGHT_GRAY.name]["r"]
+        t = self.cam_parameters[cv_gui.CAMERA_TYPE.RIGHT_GRAY.name]["t"][0:3]
+        T_w_cam_right = np.vstack((np.hstack((R, t)), [0, 0, 0, 1]))
+
+        poses_right_cam = poses @ T_w_cam_right
 
-        # Read and parse the poses
-        poses = []
-        poses_right_cam = []
+        return poses, poses_right_cam
+    
+    def _read_poses(self, pose_file):
+        """Parse all the poses of the file at once."""
         try:
-            with open(pose_file, 'r') as f:
-                lines = f.readlines()
-
-                for line in lines:
-                    T_w_cam0 = np.fromstring(line, dtype=float, sep=' ')
-                    T_w_cam0 = T_w_cam0.reshape(3, 4)
-                    T_w_cam0 = np.vstack((T_w_cam0, [0, 0, 0, 1]))
-                    poses.append(T_w_cam0)
-
-                    # The transformation of right camera w.r.t left camera
-                    R = self.cam_parameters[cv_gui.CAMERA_TYPE.RIGHT_GRAY.name]["r"]
-                    t = self.cam_parameters[cv_gui.CAMERA_TYPE.RIGHT_GRAY.name]["t"][0:3]
-                    T_w_cam_right = np.vstack((np.hstack((R, t)), [0, 0, 0, 1]))
-
-                    poses_right_cam.append(T_w_cam0@T_w_cam_right)
-                    
+            T_w_cam0 = np.loadtxt(pose_file, dtype=np.float64, ndmin=2).reshape(-1, 3, 4)
         except FileNotFoundError:
             print('Ground truth poses are not available for sequence')
-
-        return poses, poses_right_cam
+            return np.empty((0, 4, 4))
+        
+        poses = np.zeros((T_w_cam0.shape[0], 4, 4))
+        poses[:, :3, :] = T_w_cam0
+        poses[:, 3, 3] = 1.0
+        
+        return poses
+    
+    def _get_relative_poses(self, poses):
+        """Relative pose of every frame w.r.t the previous one. The first one is the identity."""
+        rel_poses = np.empty_like(poses)
+        if(len(poses) == 0):
+            return rel_poses
+        
+        rel_poses[0] = np.eye(4)
+        rel_poses[1:] = invert_poses(poses[:-1]) @ poses[1:]
+        
+        return rel_poses
     
     def _load_timestamps(self, timestamp_file):
         """Load timestamps from file."""
 
-        # Read and parse the timestamps
-        timestamps = []
+        # Read and parse the first column of all the lines at once
+        timestamps = np.empty(0)
         try:
-            with open(timestamp_file, 'r') as f:
-                lines = f.readlines()
-
-                for line in lines:
-                    timestamp = np.fromstring(line, dtype=float, sep=' ')
-                    timestamps.append(timestamp)
-
-
+            timestamps = np.loadtxt(timestamp_file, dtype=np.float64, usecols=0, ndmin=1)
         except FileNotFoundError:
             print('Time stamps are not available for sequence')
 
         return timestamps
 
     
+    def _read_color_imgs(self, idx, decode_scale):
+        imgs = {"left_color_img": cv.imread(self.left_img_files[idx], COLOR_DECODE_FLAGS[decode_scale]),
+                "right_color_img": cv.imread(self.right_img_files[idx], COLOR_DECODE_FLAGS[decode_scale])}
+        
+        return self.rectify_frame(imgs)
+    
+    def _read_gray_imgs(self, idx, decode_scale):
+        # Decode straight to grayscale
+        imgs = {"left_img": cv.imread(self.left_img_files[idx], GRAY_DECODE_FLAGS[decode_scale]),
+                "right_img": cv.imread(self.right_img_files[idx], GRAY_DECODE_FLAGS[decode_scale])}
+        
+        return self.rectify_frame(imgs)
+    
+    def _get_gray_imgs(self, left_color_img, right_color_img):
+        return {"left_img": cv.cvtColor(left_color_img, cv.COLOR_BGR2GRAY),
+                "right_img": cv.cvtColor(right_color_img, cv.COLOR_BGR2GRAY)}
+        
+    def _read_label_img(self, idx, decode_scale, frame_img):
+        label_img = cv.imread(self.label_img_files[idx], cv.IMREAD_GRAYSCALE)
+        
+        if(decode_scale != 1):
+            # Labels are class ids, they must not be interpolated
+            h, w = frame_img.shape[:2]
+            label_img = cv.resize(label_img, (w, h), interpolation=cv.INTER_NEAREST)
+            
+        return self.rectify_label_img(label_img)
+    
+    def _read_frame(self, idx, decode_scale = None):
+        """Decode the images of one frame."""
+        frame = {}
+        decode_scale = self.decode_scale if decode_scale is None else decode_scale
+        
+        if(self.color):
+            # One colour decode, the gray images are converted from it
+            frame.update(self._read_color_imgs(idx, decode_scale))
+            
+            if(self.gray):
+                frame.update(self._get_gray_imgs(frame["left_color_img"], frame["right_color_img"]))
+        else:
+            frame.update(self._read_gray_imgs(idx, decode_scale))
+            
+        if(self.label_path):
+            frame["label_img"] = self._read_label_img(idx, decode_scale, frame["left_color_img" if self.color else "left_img"])
+            
+        return frame
+    
+    def _get_lazy_frame(self, idx):
+        """The same images as _read_frame(), each decoded when it is first read."""
+        frame = LazyFrame()
+        decode_scale = self.decode_scale
+        img_key = "left_color_img" if self.color else "left_img"
+        
+        if(self.color):
+            frame.set_producer(("left_color_img", "right_color_img"), lambda: self._read_color_imgs(idx, decode_scale))
+            
+            if(self.gray):
+                frame.set_producer(("left_img", "right_img"), lambda: self._get_gray_imgs(frame["left_color_img"], frame["right_color_img"]))
+        else:
+            frame.set_producer(("left_img", "right_img"), lambda: self._read_gray_imgs(idx, decode_scale))
+            
+        if(self.label_path):
+            frame.set_producer("label_img", lambda: {"label_img": self._read_label_img(idx, decode_scale, frame[img_key] if decode_scale != 1 else None)})
+            
+        return frame
+    
     def get_next_stereo_images(self, gray = True, color = True):
+        assert gray or color, "Either gray or color frag should be true"
+        
+        if(self.prefetcher is not None and (gray != self.gray or color != self.color)):
+            # Frames in flight were decoded for the other flags
+            self.prefetcher.clear()
+            
         self.gray = gray
         self.color = color
         data = {}
-        
-        assert gray or color, "Either gray or color frag should be true"
 
         # self.idx = self.get_next_index(self.idx)
         
         if(self.idx >= self.img_count):
             return cv_gui.ERROR.END_OF_FILE, data
 
-        
-        left_color_img = cv.imread(self.left_img_files[self.idx])
-        right_color_img = cv.imread(self.right_img_files[self.idx])
+        if(self.prefetcher is not None):
+            # Already decoded on the read-ahead threads
+            data = LazyFrame(self.prefetcher.get(self.idx)) if self.lazy_frames else self.prefetcher.get(self.idx)
+        elif(self.lazy_frames):
+            data = self._get_lazy_frame(self.idx)
+        else:
+            data.update(self._read_frame(self.idx))
+            
+        if(self.lazy_frames):
+            self.add_stereo_measure_producers(data)
         
         data["image_loc"] = self.left_img_files[self.idx]
         
-        if(gray):
-            left_img = cv.cvtColor(left_color_img, cv.COLOR_RGB2GRAY)
-            right_img = cv.cvtColor(right_color_img, cv.COLOR_RGB2GRAY)
-            data["left_img"] = left_img
-            data["right_img"] = right_img
-            
-        if(color):
-            data["left_color_img"] = left_color_img
-            data["right_color_img"] = right_color_img
-        
         data["index"] = self.idx
 
         if(self.pose_file):
@@ -168,27 +335,113 @@ class DatasetLoader(StereoCamera):
             data["abs_pose_right"] = self.poses_right_cam[self.idx]
             
             if(self.idx > 0):
-                data["rel_pose"] = np.linalg.inv(self.poses[self.idx - 1])@self.poses[self.idx]
-                data["rel_pose_right"] = np.linalg.inv(self.poses_right_cam[self.idx - 1])@self.poses_right_cam[self.idx]
+                data["rel_pose"] = self.rel_poses[self.idx]
+                data["rel_pose_right"] = self.rel_poses_right_cam[self.idx]
                 
         if(self.timestamp_file):
-            data["t"] = self.timestamps[self.idx][0]
-        if(self.label_path):
-            data["label_img"] = cv.imread(self.label_img_files[self.idx], 0)
+            data["t"] = self.timestamps[self.idx]
         
         self.idx = self.get_next_index(self.idx)
         
+        if(self.prefetcher is not None):
+            # Read ahead along the same path get_next_index() will take
+            next_indices = [self.idx] + self.peek_next_indices(self.idx, self.prefetch - 1)
+            self.prefetcher.schedule([idx for idx in next_indices if idx < self.img_count])
+        
         return cv_gui.ERROR.SUCCESS, data
     
+    def get_stereo_batch(self, start, count, stride = 1, gray = True, color = True):
+        # Frames start, start + stride, ... decoded in parallel into stacked (B, H, W[, C]) arrays
+        assert gray or color, "Either gray or color frag should be true"
+        
+        if(self.prefetcher is not None and (gray != self.gray or color != self.color)):
+            self.prefetcher.clear()
+            
+        self.gray = gray
+        self.color = color
+        
+        indices = np.arange(start, min(start + count * stride, self.img_count), stride)
+        if(len(indices) == 0):
+            return cv_gui.ERROR.END_OF_FILE, {}
+        
+        # The first frame gives the shapes of the batch arrays
+        batch = {}
+        for key, img in self._read_frame(indices[0]).items():
+            batch[key] = np.empty((len(indices),) + img.shape, dtype=img.dtype)
+            batch[key][0] = img
+            
+        def read_into_batch(i):
+            for key, img in self._read_frame(indices[i]).items():
+                batch[key][i] = img
+                
+        with ThreadPoolExecutor(max_workers=self.batch_workers) as executor:
+            list(executor.map(read_into_batch, range(1, len(indices))))
+            
+        batch["index"] = indices
+        
+        if(self.pose_file):
+            batch["abs_pose"] = self.poses[indices]
+            batch["abs_pose_right"] = self.poses_right_cam[indices]
+            # The first relative pose of the sequence is the identity
+            batch["rel_pose"] = self.rel_poses[indices]
+            batch["rel_pose_right"] = self.rel_poses_right_cam[indices]
+            
+        if(self.timestamp_file):
+            batch["t"] = self.timestamps[indices]
+            
+        return cv_gui.ERROR.SUCCESS, batch
+    
+    def enable_rectification(self, raw_calib_file, left_camera = "00", right_camera = "01", cache_dir = "", alpha = 0):
+        """Rectify an unrectified (raw KITTI) sequence with the calibration of calib_cam_to_cam.txt.
+
+        Cameras 00/01 of the raw calibration are the gray pair and 02/03 the colour pair. The maps
+        are kept in cache_dir, by default next to the left images folder.
+        """
+        if(cache_dir == ""):
+            cache_dir = self.left_path.rstrip("/") + ".rectify"
+            
+        rectifier = StereoRectifier.from_kitti_raw(raw_calib_file, left_camera = left_camera, right_camera = right_camera, cache_dir = cache_dir, alpha = alpha)
+        
+        if(left_camera in ("00", "01")):
+            self.set_rectifier(rectifier, cv_gui.CAMERA_TYPE.LEFT_GRAY, cv_gui.CAMERA_TYPE.RIGHT_GRAY)
+        else:
+            self.set_rectifier(rectifier, cv_gui.CAMERA_TYPE.LEFT_RGB, cv_gui.CAMERA_TYPE.RIGHT_RGB)
+            
+        # Frames read ahead are not rectified
+        if(self.prefetcher is not None):
+            self.prefetcher.clear()
+            
+        return rectifier
+    
+    def get_basic_calib_params(self, camera_type):
+        basic_calib_params = super().get_basic_calib_params(camera_type)
+        
+        # The intrinsics are given for the full resolution images
+        for key in ["fx", "fy", "cx", "cy"]:
+            if(key in basic_calib_params):
+                basic_calib_params[key] = basic_calib_params[key] / self.decode_scale
+                
+        return basic_calib_params
+    
     def get_frame_count(self):
         return self.img_count
         
     def jump_to(self, frame_number):
         # Jump to the frame number. The next call to grab() will read the provided frame number.
         self.idx = frame_number
+        self.seek_frame_plan(frame_number)
+        
+        # Frames read ahead of the old position are of no use anymore
+        if(self.prefetcher is not None):
+            self.prefetcher.clear()
         
     def close(self):
-        return
+        self.close_proxies()
+        self.close_rectifier()
+        
+        if(self.prefetcher is not None):
+            self.prefetcher.close()
+            self.prefetcher = None
     
     def __str__(self):
         return f"The number of images found are {self.img_count} \n {super().__str__()}"
@@ -0,0 +1,206 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+
+import cv2 as cv
+import numpy as np
+
+from cv_gui.dataset_handlers.stereo_camera import StereoCamera
+import cv_gui.utils.flags as cv_gui
+
+# Set up in every worker process by _init_worker
+_worker_camera = None
+_worker_slots = {}
+
+
+def _init_worker(camera_config):
+    global _worker_camera
+
+    # One frame per worker process, OpenCV's own threads would oversubscribe the CPU
+    cv.setNumThreads(1)
+
+    _worker_camera = StereoCamera(dataset = camera_config["dataset"])
+    _worker_camera.cam_parameters = camera_config["cam_parameters"]
+    if(camera_config["base_camera_type"] is not None):
+        _worker_camera.set_basic_calibration_params(camera_config["base_camera_type"], camera_config["basic_calibration_params"])
+    _worker_camera.set_stereo_matcher(camera_config["matcher_name"], camera_config["matcher_downscale"], **camera_config["matcher_params"])
+
+
+def _attach_slot(slot_name):
+    # Workers attach each slot once and keep it open
+    slot = _worker_slots.get(slot_name)
+    if(slot is None):
+        slot = shared_memory.SharedMemory(name=slot_name)
+        _worker_slots[slot_name] = slot
+
+    return slot
+
+
+def _compute_slot(slot_name, layout, gray, fill, compute_depth):
+    slot = _attach_slot(slot_name)
+    views = {name: np.ndarray(shape, dtype=dtype, buffer=slot.buf, offset=offset) for name, (shape, dtype, offset) in layout.items()}
+
+    # The results are written straight into the slot
+    _worker_camera.get_disparity_img(views["left"], views["right"], fill = fill, gray = gray, out = views["disparity_img"])
+    if(compute_depth):
+        _worker_camera.get_depth_img_from_disparity_img(views["disparity_img"], out = views["depth_img"])
+
+
+def iter_stereo_frames(camera, gray = True, color = True):
+    # Frames of any camera until the end of the sequence
+    while(True):
+        status, data = camera.get_next_stereo_images(gray = gray, color = color)
+        if(status != cv_gui.ERROR.SUCCESS):
+            return
+        yield data
+
+
+class DepthPipeline:
+    """Computes disparity and depth for a stream of stereo frames on a pool of worker processes.
+
+    Every worker builds its own StereoCamera from the calibration and the stereo matcher of `stereo_camera`.
+    Frames are handed to the workers through a ring of shared memory slots, at most `max_in_flight` at a
+    time, and the results come back in the order the frames went in. Frames of a camera that reuses its
+    buffers (ZED) are held with acquire_frame() while in flight, each result is released with release_frame().
+    """
+    def __init__(self, stereo_camera, num_workers = None, max_in_flight = None, compute_depth = True, fill = False):
+        self.num_workers = num_workers or os.cpu_count()
+        self.max_in_flight = max_in_flight or 2 * self.num_workers
+        self.compute_depth = compute_depth
+        self.fill = fill
+
+        if(compute_depth):
+            assert stereo_camera.base_camera_type is not None, "Call set_base_camera_type_for_intrinsics() before computing the depth"
+
+        camera_config = {"dataset": stereo_camera.dataset,
+                         "cam_parameters": stereo_camera.cam_parameters,
+                         "base_camera_type": stereo_camera.base_camera_type,
+                         "basic_calibration_params": stereo_camera.basic_calibration_params,
+                         "matcher_name": stereo_camera.stereo_matcher_name,
+                         "matcher_params": stereo_camera.stereo_matcher_params,
+                         "matcher_downscale": stereo_camera.stereo_matcher_downscale}
+
+        self.executor = ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_worker, initargs=(camera_config,))
+
+        # Shared memory slots, allocated once the first frame gives the image size
+        self.slots = []
+        self.free_slots = deque()
+        self.img_shape = None
+        self.layout = None
+
+        # (slot, frame data, camera, future) in submission order
+        self.in_flight = deque()
+
+    def _allocate_slots(self, img_shape):
+        h, w = img_shape[:2]
+        sections = [("left", img_shape, np.uint8),
+                    ("right", img_shape, np.uint8),
+                    ("disparity_img", (h, w), np.float32),
+                    ("depth_img", (h, w), np.float32)]
+
+        self.layout = {}
+        offset = 0
+        for name, shape, dtype in sections:
+            self.layout[name] = (shape, np.dtype(dtype).str, offset)
+            offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+        self.img_shape = img_shape
+        for _ in range(self.max_in_flight):
+            slot = shared_memory.SharedMemory(create=True, size=offset)
+            self.slots.append(slot)
+            self.free_slots.append(slot)
+
+    def _get_view(self, slot, name):
+        shape, dtype, offset = self.layout[name]
+        return np.ndarray(shape, dtype=dtype, buffer=slot.buf, offset=offset)
+
+    def submit(self, data, camera = None):
+        """Start the computation for one frame. Waits for the oldest frame first if the window is full and returns it.
+
+        The frame is held on `camera` while in flight, the result holds that reference: call
+        camera.release_frame(result) once done with it.
+        """
+        gray = "left_img" in data
+        left_img = data["left_img"] if gray else data["left_color_img"]
+        right_img = data["right_img"] if gray else data["right_color_img"]
+
+        if(self.layout is None):
+            self._allocate_slots(left_img.shape)
+        assert left_img.shape == self.img_shape, f"All the frames should have the shape {self.img_shape}, got {left_img.shape}"
+
+        result = None
+        if(not self.free_slots):
+            result = self.get_result()
+
+        slot = self.free_slots.popleft()
+        self._get_view(slot, "left")[...] = left_img
+        self._get_view(slot, "right")[...] = right_img
+
+        if(camera is not None):
+            camera.acquire_frame(data)
+        future = self.executor.submit(_compute_slot, slot.name, self.layout, gray, self.fill, self.compute_depth)
+        self.in_flight.append((slot, data, camera, future))
+
+        return result
+
+    def get_result(self):
+        # Oldest frame in flight with "disparity_img" (and "depth_img") added, None if nothing is in flight
+        if(not self.in_flight):
+            return None
+
+        slot, data, _, future = self.in_flight.popleft()
+        try:
+            future.result()
+
+            # Copy out so the slot can take the next frame
+            data = data.copy()
+            data["disparity_img"] = self._get_view(slot, "disparity_img").copy()
+            if(self.compute_depth):
+                data["depth_img"] = self._get_view(slot, "depth_img").copy()
+        finally:
+            self.free_slots.append(slot)
+
+        return data
+
+    def process(self, frames, camera = None):
+        # Generator over the results of an iterable of frame dicts of `camera`, in the same order. See submit()
+        max_in_flight = self.max_in_flight
+        num_buffers = getattr(camera, "num_buffers", None)
+        if(num_buffers is not None):
+            # The camera hands out the next frame only while one of its buffer sets is free: the frames in
+            # flight leave one for the grab and one for the result the caller holds
+            max_in_flight = max(1, min(max_in_flight, num_buffers - 2))
+            
+        for data in frames:
+            result = self.submit(data, camera)
+            if(camera is not None):
+                # The pipeline holds the frame now
+                camera.release_frame(data)
+            if(result is not None):
+                yield result
+                
+            while(len(self.in_flight) >= max_in_flight):
+                yield self.get_result()
+
+        while(self.in_flight):
+            yield self.get_result()
+
+    def process_camera(self, camera, gray = True, color = False):
+        return self.process(iter_stereo_frames(camera, gray = gray, color = color), camera)
+
+    def close(self):
+        for _, _, _, future in self.in_flight:
+            future.cancel()
+        self.executor.shutdown(wait=True)
+        for _, data, camera, _ in self.in_flight:
+            if(camera is not None):
+                camera.release_frame(data)
+        self.in_flight.clear()
+
+        for slot in self.slots:
+            slot.close()
+            slot.unlink()
+        self.slots = []
+        self.free_slots.clear()
+        self.layout = None
@@ -0,0 +1,97 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import cv2 as cv
+import numpy as np
+
+import cv_gui.utils.flags as cv_gui
+
+
+class DatasetExporter:
+    """Writes the stereo frames of a camera (ZED, DatasetLoader, ...) as an image dataset.
+
+    The images are named like the GUI records them, Seq001FrXXXXXXXXL/R.jpeg, and the frame timestamps
+    go to a timestamps file. Frames are read as fast as the camera delivers them while a pool of writer
+    threads encodes and writes them, with at most `max_pending` frames waiting to be written.
+    """
+    def __init__(self, camera, output_dir, num_writers = None, max_pending = None, ext = "jpeg", color = True,
+                 seq_name = "Seq001", timestamp_file = "timestamps.txt"):
+        self.camera = camera
+        self.output_dir = output_dir
+        self.num_writers = num_writers or os.cpu_count()
+        self.max_pending = max_pending or 2 * self.num_writers
+        self.ext = ext
+        self.color = color
+        self.seq_name = seq_name
+        self.timestamp_file = timestamp_file
+
+        # imwrite releases the GIL, so the encodes run in parallel on threads
+        self.executor = ThreadPoolExecutor(max_workers=self.num_writers, thread_name_prefix="export_writer")
+
+        # Write futures in submission order
+        self.pending = deque()
+
+    def get_img_file(self, idx, side):
+        return os.path.join(self.output_dir, f"{self.seq_name}Fr{str(idx).zfill(8)}{side}.{self.ext}")
+
+    def _write_frame(self, data, imgs):
+        try:
+            for file_name, img in imgs:
+                if(not cv.imwrite(file_name, img)):
+                    raise IOError(f"Could not write {file_name}")
+        finally:
+            self.camera.release_frame(data)
+
+    def _wait_oldest(self):
+        # Raises the error of a failed write
+        self.pending.popleft().result()
+
+    def export(self, start = 0, count = None, progress_every = 100):
+        """Export `count` frames from `start` (every frame to the end by default). Returns the number of frames written."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.camera.jump_to(start)
+
+        left_key, right_key = ("left_color_img", "right_color_img") if self.color else ("left_img", "right_img")
+        timestamps = []
+        num_frames = 0
+        try:
+            while(count is None or num_frames < count):
+                status, data = self.camera.get_next_stereo_images(gray = not self.color, color = self.color)
+                if(status != cv_gui.ERROR.SUCCESS):
+                    break
+
+                imgs = []
+                for key, side in ((left_key, "L"), (right_key, "R")):
+                    img = data[key]
+                    if("buffer_set" not in data and isinstance(img, np.ndarray) and not img.flags.owndata):
+                        # A view on a camera buffer that the next grab overwrites
+                        img = img.copy()
+                    imgs.append((self.get_img_file(data["index"], side), img))
+
+                if("t" in data):
+                    timestamps.append(f"{data['t']}")
+
+                if(len(self.pending) >= self.max_pending):
+                    self._wait_oldest()
+                self.pending.append(self.executor.submit(self._write_frame, data, imgs))
+
+                num_frames += 1
+                if(progress_every and num_frames % progress_every == 0):
+                    print(f"Exported {num_frames} frames")
+
+            while(self.pending):
+                self._wait_oldest()
+        finally:
+            for future in self.pending:
+                future.cancel()
+            self.pending.clear()
+
+        if(timestamps and self.timestamp_file):
+            with open(os.path.join(self.output_dir, self.timestamp_file), "w") as f:
+                f.write("\n".join(timestamps))
+
+        return num_frames
+
+    def close(self):
+        self.executor.shutdown(wait=True)
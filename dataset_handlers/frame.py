@@ -0,0 +1,102 @@
+from collections.abc import MutableMapping
+import threading
+
+
+class LazyFrame(MutableMapping):
+    """Frame data with the same mapping interface as the data dict, where values are produced on first access.
+
+    A producer is registered for one or several keys and returns a dict with the values of those keys,
+    e.g. one decode gives both colour images. Produced values are memoized for the life of the frame.
+    """
+    def __init__(self, values = None):
+        self.values = dict(values or {})
+
+        # key -> (keys, producer) for the values that have not been produced yet
+        self.producers = {}
+
+        # The producers only work until the source moves on (e.g. the next ZED grab), see invalidate()
+        self.volatile = False
+
+        # Several threads (the process thread and the GUI) may read the same frame
+        self.lock = threading.RLock()
+
+    def set_producer(self, keys, producer):
+        keys = (keys,) if isinstance(keys, str) else tuple(keys)
+        for key in keys:
+            self.values.pop(key, None)
+            self.producers[key] = (keys, producer)
+
+    def __getitem__(self, key):
+        if(key in self.values):
+            return self.values[key]
+
+        with self.lock:
+            # Another thread may have produced it in the meantime
+            if(key in self.values):
+                return self.values[key]
+
+            if(key not in self.producers):
+                raise KeyError(key)
+
+            keys, producer = self.producers[key]
+            produced = producer()
+            for produced_key in keys:
+                self.producers.pop(produced_key, None)
+            self.values.update(produced)
+
+        return self.values[key]
+
+    def __setitem__(self, key, value):
+        self.producers.pop(key, None)
+        self.values[key] = value
+
+    def __delitem__(self, key):
+        if(key not in self):
+            raise KeyError(key)
+
+        self.values.pop(key, None)
+        self.producers.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self.values or key in self.producers
+
+    def __iter__(self):
+        yield from list(self.values)
+        yield from [key for key in list(self.producers) if key not in self.values]
+
+    def __len__(self):
+        return len(self.values) + sum(key not in self.values for key in self.producers)
+
+    def is_loaded(self, key):
+        return key in self.values
+
+    def loaded_items(self):
+        return list(self.values.items())
+
+    def retain(self, keys = None):
+        # Produce `keys` (all by default) now, e.g. before the source of the producers goes away
+        for key in list(self) if keys is None else keys:
+            if(key in self):
+                self[key]
+
+    def invalidate(self):
+        # The producers cannot be run anymore, the values that were not produced are dropped
+        with self.lock:
+            self.producers.clear()
+
+    def copy(self):
+        # Shallow copy that shares the producers that have not run yet
+        frame = LazyFrame(self.values)
+        frame.producers = dict(self.producers)
+        frame.volatile = self.volatile
+
+        return frame
+
+    def materialize(self):
+        # Plain dict with every value produced
+        self.retain()
+
+        return dict(self.values)
+
+    def __repr__(self):
+        return f"LazyFrame(loaded={list(self.values)}, pending={[key for key in self.producers if key not in self.values]})"
@@ -0,0 +1,285 @@
+import argparse
+import json
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+from cv_gui.dataset_handlers.stereo_camera import StereoCamera
+from cv_gui.dataset_handlers.dataset_loader import DatasetLoader
+import cv_gui.utils.flags as cv_gui
+
+PACK_MAGIC = b"CVGUIPK1"
+PACK_ALIGNMENT = 4096
+
+
+def _align(value, alignment = PACK_ALIGNMENT):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def read_pack_header(pack_file):
+    with open(pack_file, "rb") as f:
+        magic = f.read(len(PACK_MAGIC))
+        assert magic == PACK_MAGIC, f"{pack_file} is not a frame pack"
+
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size).decode("utf-8"))
+
+    return header
+
+
+def pack_stereo_sequence(pack_file, left_img_files, right_img_files, label_img_files = None, timestamps = None,
+                         gray = True, color = True, num_workers = 4):
+    """Decode a left/right/label image sequence once and store it as a fixed-stride raw frame pack.
+
+    File layout: magic, header size, JSON header, then every frame at data_offset + idx * frame_stride.
+    Each frame holds the sections listed in the header (e.g. left_color_img, right_color_img, left_img,
+    right_img, label_img) at fixed offsets.
+    """
+    assert gray or color, "Either gray or color frag should be true"
+    assert len(left_img_files) == len(right_img_files), "Left and right sequences have different lengths"
+    assert len(left_img_files) > 0, "There are no frames to pack"
+
+    frame_count = len(left_img_files)
+
+    # The first frame gives the shape of every section
+    first_color_img = cv.imread(left_img_files[0])
+    h, w = first_color_img.shape[:2]
+
+    section_shapes = []
+    if(color):
+        section_shapes += [("left_color_img", (h, w, 3)), ("right_color_img", (h, w, 3))]
+    if(gray):
+        section_shapes += [("left_img", (h, w)), ("right_img", (h, w))]
+    if(label_img_files):
+        section_shapes += [("label_img", (h, w))]
+
+    sections = []
+    offset = 0
+    for name, shape in section_shapes:
+        sections.append({"name": name, "shape": list(shape), "dtype": "uint8", "offset": offset})
+        offset = _align(offset + int(np.prod(shape)), 64)
+    frame_stride = _align(offset)
+
+    header = {"version": 1,
+              "frame_count": frame_count,
+              "frame_stride": frame_stride,
+              "data_offset": 0,
+              "sections": sections,
+              "timestamps": None if timestamps is None else [float(t) for t in timestamps]}
+
+    # The data offset depends on the size of the header itself
+    header_size = len(json.dumps(header).encode("utf-8")) + 32
+    header["data_offset"] = _align(len(PACK_MAGIC) + 8 + header_size)
+    header_bytes = json.dumps(header).encode("utf-8").ljust(header["data_offset"] - len(PACK_MAGIC) - 8)
+
+    with open(pack_file, "wb") as f:
+        f.write(PACK_MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        f.truncate(header["data_offset"] + frame_count * frame_stride)
+
+    frames = np.memmap(pack_file, dtype=np.uint8, mode="r+", offset=header["data_offset"], shape=(frame_count, frame_stride))
+
+    def write_frame(idx):
+        left_color_img = cv.imread(left_img_files[idx])
+        right_color_img = cv.imread(right_img_files[idx])
+
+        images = {}
+        if(color):
+            images["left_color_img"] = left_color_img
+            images["right_color_img"] = right_color_img
+        if(gray):
+            images["left_img"] = cv.cvtColor(left_color_img, cv.COLOR_BGR2GRAY)
+            images["right_img"] = cv.cvtColor(right_color_img, cv.COLOR_BGR2GRAY)
+        if(label_img_files):
+            images["label_img"] = cv.imread(label_img_files[idx], cv.IMREAD_GRAYSCALE)
+
+        for section in sections:
+            img = images[section["name"]]
+            assert list(img.shape) == section["shape"], f"Frame {idx} has a different shape than the first frame"
+
+            frames[idx, section["offset"]:section["offset"] + img.nbytes] = img.reshape(-1)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        list(executor.map(write_frame, range(frame_count)))
+
+    frames.flush()
+    del frames
+
+    return header
+
+
+def pack_dataset_loader(dataset_loader, pack_file, gray = True, color = True, num_workers = 4):
+    # Pack the sequence of an initialised DatasetLoader
+    label_img_files = dataset_loader.label_img_files if dataset_loader.label_path else None
+    timestamps = dataset_loader.timestamps if dataset_loader.timestamp_file else None
+
+    return pack_stereo_sequence(pack_file, dataset_loader.left_img_files, dataset_loader.right_img_files, label_img_files = label_img_files,
+                                timestamps = timestamps, gray = gray, color = color, num_workers = num_workers)
+
+
+class FramePackLoader(StereoCamera):
+    """Plays back a frame pack written by pack_stereo_sequence().
+
+    The images handed out are zero-copy np.memmap views, so reading a frame costs no decode and
+    the OS page cache keeps recently played frames in memory. The pack is mapped copy-on-write:
+    callbacks can draw on the images, the pages they touch are copied and the file is never written.
+    """
+    def __init__(self, pack_file = "", calib_file = "", gray = True, color = True, seq_control_file = ""):
+        super().__init__(dataset = cv_gui.DATASET_TYPE.KITTI, seq_control_file = seq_control_file)
+
+        self.dataset_type = cv_gui.DATASET_TYPE.KITTI
+
+        self.pack_file = pack_file
+        self.calib_file = calib_file
+
+        self.gray = gray
+        self.color = color
+
+        self.header = None
+        self.frames = None
+        self.sections = {}
+        self.timestamps = None
+
+        self.idx = 0
+        self.img_count = 0
+
+    def set_pack_file(self, path):
+        self.pack_file = path
+
+    def set_calib_file_path(self, path):
+        self.calib_file = path
+
+    def init(self):
+        self.header = read_pack_header(self.pack_file)
+        self.img_count = self.header["frame_count"]
+
+        self.frames = np.memmap(self.pack_file, dtype=np.uint8, mode="c", offset=self.header["data_offset"],
+                                shape=(self.img_count, self.header["frame_stride"]))
+
+        # One (N, H, W[, C]) view per section
+        self.sections = {}
+        for section in self.header["sections"]:
+            dtype = np.dtype(section["dtype"])
+            nbytes = int(np.prod(section["shape"])) * dtype.itemsize
+
+            section_bytes = self.frames[:, section["offset"]:section["offset"] + nbytes]
+            self.sections[section["name"]] = section_bytes.view(dtype).reshape([self.img_count] + section["shape"])
+
+        if(self.header["timestamps"] is not None):
+            self.timestamps = np.array(self.header["timestamps"], dtype=np.float64)
+
+        # Load calibration params
+        if(self.calib_file):
+            self.load_caliberation_paramters(calib_file=self.calib_file)
+
+        # Read config file
+        if(self.seq_control_file != ""):
+            self.process_seq_control_file(self.seq_control_file)
+
+    def get_next_stereo_images(self, gray = True, color = True):
+        assert gray or color, "Either gray or color frag should be true"
+
+        self.gray = gray
+        self.color = color
+        data = {}
+
+        if(self.idx >= self.img_count):
+            return cv_gui.ERROR.END_OF_FILE, data
+
+        # A pack written without colour only has the gray images, they are given instead
+        has_color = "left_color_img" in self.sections
+        if(color and has_color):
+            data["left_color_img"] = self.sections["left_color_img"][self.idx]
+            data["right_color_img"] = self.sections["right_color_img"][self.idx]
+
+        if(gray or not has_color):
+            if("left_img" in self.sections):
+                data["left_img"] = self.sections["left_img"][self.idx]
+                data["right_img"] = self.sections["right_img"][self.idx]
+            else:
+                data["left_img"] = cv.cvtColor(self.sections["left_color_img"][self.idx], cv.COLOR_BGR2GRAY)
+                data["right_img"] = cv.cvtColor(self.sections["right_color_img"][self.idx], cv.COLOR_BGR2GRAY)
+
+        if("label_img" in self.sections):
+            data["label_img"] = self.sections["label_img"][self.idx]
+
+        data["index"] = self.idx
+
+        if(self.timestamps is not None):
+            data["t"] = self.timestamps[self.idx]
+
+        self.idx = self.get_next_index(self.idx)
+
+        return cv_gui.ERROR.SUCCESS, data
+
+    def get_stereo_batch(self, start, count, stride = 1, gray = True, color = True):
+        # Strided slices of the pack, the image arrays are zero-copy (B, H, W[, C]) views
+        assert gray or color, "Either gray or color frag should be true"
+
+        indices = np.arange(start, min(start + count * stride, self.img_count), stride)
+        if(len(indices) == 0):
+            return cv_gui.ERROR.END_OF_FILE, {}
+
+        frames = slice(int(indices[0]), int(indices[-1]) + 1, stride)
+        batch = {"index": indices}
+
+        has_color = "left_color_img" in self.sections
+        if(color and has_color):
+            batch["left_color_img"] = self.sections["left_color_img"][frames]
+            batch["right_color_img"] = self.sections["right_color_img"][frames]
+
+        if(gray or not has_color):
+            if("left_img" in self.sections):
+                batch["left_img"] = self.sections["left_img"][frames]
+                batch["right_img"] = self.sections["right_img"][frames]
+            else:
+                batch["left_img"] = np.stack([cv.cvtColor(img, cv.COLOR_BGR2GRAY) for img in self.sections["left_color_img"][frames]])
+                batch["right_img"] = np.stack([cv.cvtColor(img, cv.COLOR_BGR2GRAY) for img in self.sections["right_color_img"][frames]])
+
+        if("label_img" in self.sections):
+            batch["label_img"] = self.sections["label_img"][frames]
+
+        if(self.timestamps is not None):
+            batch["t"] = self.timestamps[indices]
+
+        return cv_gui.ERROR.SUCCESS, batch
+
+    def get_frame_count(self):
+        return self.img_count
+
+    def jump_to(self, frame_number):
+        # Jump to the frame number. The next call to get_next_stereo_images() will read the provided frame number.
+        self.idx = frame_number
+        self.seek_frame_plan(frame_number)
+
+    def close(self):
+        self.sections = {}
+        self.frames = None
+
+    def __str__(self):
+        return f"The number of frames in the pack are {self.img_count} \n {super().__str__()}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack a KITTI style image sequence into a memory-mapped frame pack")
+    parser.add_argument("--left", required=True, help="Left images folder")
+    parser.add_argument("--right", required=True, help="Right images folder")
+    parser.add_argument("--label", default="", help="Label images folder")
+    parser.add_argument("--timestamps", default="", help="Timestamps file")
+    parser.add_argument("--output", required=True, help="Frame pack file to write")
+    parser.add_argument("--no-gray", action="store_true", help="Do not store the gray images")
+    parser.add_argument("--no-color", action="store_true", help="Do not store the colour images")
+    parser.add_argument("--workers", type=int, default=4, help="Number of decode threads")
+    args = parser.parse_args()
+
+    dataset_loader = DatasetLoader(left_path=args.left, right_path=args.right, label_path=args.label, timestamp_file=args.timestamps)
+    dataset_loader.init()
+
+    header = pack_dataset_loader(dataset_loader, args.output, gray=not args.no_gray, color=not args.no_color, num_workers=args.workers)
+    print(f"Packed {header['frame_count']} frames into {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import queue
+import threading
+import time
+
+import cv_gui.utils.flags as cv_gui
+
+
+class GrabProducer:
+    """Runs `grab_frame()` on its own thread and hands the frames over through a bounded queue.
+
+    `grab_frame()` returns (status, data, next_idx). It is called until it returns a status other than
+    SUCCESS, that item is queued as well and ends the thread. Frames that are dropped (DROP_OLDEST, stop())
+    are given to `release_frame(data)`. stop() calls `wake()` to wake up a `grab_frame()` that waits on
+    something other than the queue, which should then check `stop_event` and return.
+    """
+    def __init__(self, grab_frame, release_frame, queue_size = 2, policy = cv_gui.QUEUE_POLICY.BLOCK, wake = None):
+        self.grab_frame = grab_frame
+        self.release_frame = release_frame
+        self.policy = policy
+        self.wake = wake
+
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # Last item of the thread (END_OF_FILE, ...), given again to get() once the queue is empty
+        self.end_item = None
+
+    def start(self):
+        self.stop_event.clear()
+        self.end_item = None
+        self.thread = threading.Thread(target=self._run, name="grab_producer", daemon=True)
+        self.thread.start()
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _run(self):
+        while(not self.stop_event.is_set()):
+            item = self.grab_frame()
+            if(item[0] != cv_gui.ERROR.SUCCESS):
+                self.end_item = item
+                self._put(item)
+                return
+
+            if(not self._put(item)):
+                self.release_frame(item[1])
+                return
+
+    def _put(self, item):
+        # False if the producer was stopped before there was room for the item
+        while(not self.stop_event.is_set()):
+            if(self.policy == cv_gui.QUEUE_POLICY.DROP_OLDEST):
+                try:
+                    self.frames.put_nowait(item)
+                    return True
+                except queue.Full:
+                    self._drop_oldest()
+            else:
+                try:
+                    # Wakes up now and then to notice stop()
+                    self.frames.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+
+        return False
+
+    def _drop_oldest(self):
+        try:
+            item = self.frames.get_nowait()
+        except queue.Empty:
+            return
+
+        if(item[0] == cv_gui.ERROR.SUCCESS):
+            self.release_frame(item[1])
+
+    def get(self):
+        # Oldest queued (status, data, next_idx), waits for the producer
+        while(True):
+            try:
+                return self.frames.get(timeout=0.1)
+            except queue.Empty:
+                if(not self.is_running() and self.frames.empty()):
+                    return self.end_item
+
+    def stop(self, timeout = 5.0):
+        # The queued frames are released. The thread may be waiting for one of them to free a buffer
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        while(self.is_running() and time.monotonic() < deadline):
+            while(not self.frames.empty()):
+                self._drop_oldest()
+            if(self.wake is not None):
+                self.wake()
+            self.thread.join(timeout=0.05)
+
+        if(self.is_running()):
+            print("The grab producer did not stop in time")
+
+        while(not self.frames.empty()):
+            self._drop_oldest()
+        self.thread = None
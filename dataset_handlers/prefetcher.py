@@ -0,0 +1,47 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FramePrefetcher:
+    """Decodes frames ahead of the playback cursor on a thread pool.
+
+    `load_frame(idx)` is called on the worker threads and its result is kept until
+    `get(idx)` consumes it. At most `depth` frames are decoded or in flight at once.
+    """
+    def __init__(self, load_frame, depth = 8, num_workers = 4):
+        self.load_frame = load_frame
+        self.depth = depth
+        self.num_workers = num_workers
+
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="frame_prefetch")
+
+        # Frame index -> Future, in the order they were scheduled
+        self.pending = OrderedDict()
+
+    def schedule(self, indices):
+        # Drop everything that is no longer on the read-ahead plan
+        wanted = list(indices)[:self.depth]
+        for idx in list(self.pending.keys()):
+            if(idx not in wanted):
+                self.pending.pop(idx).cancel()
+
+        for idx in wanted:
+            if(idx not in self.pending):
+                self.pending[idx] = self.executor.submit(self.load_frame, idx)
+
+    def get(self, idx):
+        # Use the read-ahead result if there is one, otherwise decode on the calling thread
+        future = self.pending.pop(idx, None)
+        if(future is None or future.cancelled()):
+            return self.load_frame(idx)
+
+        return future.result()
+
+    def clear(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+
+    def close(self):
+        self.clear()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+
+# Only the images that are displayed get a proxy
+PROXY_KEYS = ("left_img", "right_img", "left_color_img", "right_color_img")
+
+
+class ProxyCache:
+    """Downscaled copies (1/2, 1/4, ...) of the frames of a sequence, stored on disk next to it.
+
+    Proxies are written either from frames that are already decoded (put) or by a background
+    pass over the sequence (generate). The GUI shows them while the slider is being dragged.
+    The camera completes them into frames, see StereoCamera.get_proxy_frame().
+    """
+    def __init__(self, proxy_dir, levels = (2, 4), preview_level = 2, num_workers = 2, jpeg_quality = 90):
+        assert preview_level in levels, "The preview level should be one of the proxy levels"
+
+        self.proxy_dir = proxy_dir
+        self.levels = tuple(levels)
+        self.preview_level = preview_level
+        self.jpeg_quality = jpeg_quality
+
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="proxy_writer")
+        self.stop_event = threading.Event()
+
+        # Timestamps of the frames that have a proxy, for sources that only know them once decoded
+        self.timestamps = {}
+        self.timestamps_file = os.path.join(self.proxy_dir, "timestamps.json")
+        if(os.path.isfile(self.timestamps_file)):
+            with open(self.timestamps_file) as f:
+                self.timestamps = {int(idx): t for idx, t in json.load(f).items()}
+
+        for level in self.levels:
+            for key in PROXY_KEYS:
+                os.makedirs(os.path.join(self.proxy_dir, str(level), key), exist_ok=True)
+
+    def get_proxy_file(self, idx, level, key):
+        return os.path.join(self.proxy_dir, str(level), key, f"{str(idx).zfill(8)}.jpg")
+
+    def has_frame(self, idx, level = None):
+        level = self.preview_level if level is None else level
+        return any(os.path.isfile(self.get_proxy_file(idx, level, key)) for key in PROXY_KEYS)
+
+    def get_frame(self, idx, level = None):
+        # Proxy images of the frame, or None if there are none yet
+        level = self.preview_level if level is None else level
+
+        data = {}
+        for key in PROXY_KEYS:
+            proxy_file = self.get_proxy_file(idx, level, key)
+            if(os.path.isfile(proxy_file)):
+                flags = cv.IMREAD_COLOR if key.endswith("color_img") else cv.IMREAD_GRAYSCALE
+                data[key] = cv.imread(proxy_file, flags)
+
+        if(not data):
+            return None
+
+        if(idx in self.timestamps):
+            data["t"] = self.timestamps[idx]
+
+        return data
+
+    def put(self, idx, data):
+        # Downscale now, the source arrays may be reused by the camera. Encoding happens in the background
+        if("t" in data):
+            self.timestamps[idx] = data["t"]
+
+        for level in self.levels:
+            if(self.has_frame(idx, level)):
+                continue
+
+            for key in PROXY_KEYS:
+                if(key in data):
+                    h, w = data[key].shape[:2]
+                    proxy_img = cv.resize(data[key], (w // level, h // level), interpolation=cv.INTER_AREA)
+                    self.executor.submit(self._write, self.get_proxy_file(idx, level, key), proxy_img)
+
+    def generate(self, read_frame, indices):
+        """Write the missing proxies of `indices` in the background. read_frame(idx, level) returns the frame at 1/level."""
+        self.stop_event.clear()
+
+        def generate_():
+            for idx in indices:
+                for level in self.levels:
+                    if(self.stop_event.is_set()):
+                        return
+                    if(self.has_frame(idx, level)):
+                        continue
+
+                    frame = read_frame(idx, level)
+                    for key in PROXY_KEYS:
+                        if(key in frame):
+                            self._write(self.get_proxy_file(idx, level, key), frame[key])
+
+        return self.executor.submit(generate_)
+
+    def _write(self, proxy_file, img):
+        # Write to a temporary file first so a half written proxy is never read
+        tmp_file = proxy_file + ".tmp.jpg"
+        cv.imwrite(tmp_file, img, [cv.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        os.replace(tmp_file, proxy_file)
+
+    def close(self):
+        self.stop_event.set()
+        self.executor.shutdown(wait=True)
+
+        if(self.timestamps):
+            with open(self.timestamps_file, "w") as f:
+                json.dump(self.timestamps, f)
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+# Images of a frame that get rectified, with the view they belong to. Labels are annotations of the left view
+RECTIFIED_KEYS = {"left_img": "left", "left_color_img": "left", "right_img": "right", "right_color_img": "right", "label_img": "left"}
+
+# Images of class ids, they must not be interpolated
+NEAREST_KEYS = {"label_img"}
+
+
+def _as_rotation_matrix(r):
+    # Rotations come either as a matrix or as a Rodrigues vector (ZED SDK)
+    r = np.asarray(r, dtype=np.float64)
+    if(r.size == 3):
+        return cv.Rodrigues(r.reshape(3, 1))[0]
+
+    return r.reshape(3, 3)
+
+
+def load_kitti_raw_calibration(calib_file, left_camera = "00", right_camera = "01"):
+    """Unrectified stereo calibration of a raw KITTI sequence (calib_cam_to_cam.txt)."""
+    values = {}
+    with open(calib_file) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            try:
+                values[key] = np.array(value.split(), dtype=np.float64)
+            except ValueError:
+                # calib_time
+                continue
+
+    k_left, k_right = values[f"K_{left_camera}"].reshape(3, 3), values[f"K_{right_camera}"].reshape(3, 3)
+    r_left, r_right = values[f"R_{left_camera}"].reshape(3, 3), values[f"R_{right_camera}"].reshape(3, 3)
+    t_left, t_right = values[f"T_{left_camera}"].reshape(3, 1), values[f"T_{right_camera}"].reshape(3, 1)
+
+    # R and T of the file are relative to camera 00, stereoRectify wants right relative to left
+    r = r_right @ r_left.T
+    t = t_right - r @ t_left
+    img_size = tuple(int(v) for v in values[f"S_{left_camera}"])
+
+    return {"k_left": k_left, "d_left": values[f"D_{left_camera}"], "k_right": k_right, "d_right": values[f"D_{right_camera}"],
+            "r": r, "t": t, "img_size": img_size}
+
+
+class StereoRectifier:
+    """Rectifies unrectified stereo frames with cv.remap.
+
+    The initUndistortRectifyMap lookup tables are computed once per calibration and resolution and kept
+    as fixed-point CV_16SC2 maps. With a cache_dir they are stored there under a hash of the calibration,
+    so later sessions load them instead of rebuilding them. The left and right remaps run in parallel.
+    """
+    def __init__(self, k_left, d_left, k_right, d_right, r, t, img_size, alpha = 0, cache_dir = "", num_workers = 2):
+        self.k_left = np.asarray(k_left, dtype=np.float64).reshape(3, 3)
+        self.k_right = np.asarray(k_right, dtype=np.float64).reshape(3, 3)
+        self.d_left = np.asarray(d_left, dtype=np.float64).ravel()
+        self.d_right = np.asarray(d_right, dtype=np.float64).ravel()
+        self.r = _as_rotation_matrix(r)
+        self.t = np.asarray(t, dtype=np.float64).ravel()[:3].reshape(3, 1)
+
+        # (width, height) the calibration was done at
+        self.img_size = tuple(int(v) for v in img_size)
+        self.alpha = alpha
+        self.cache_dir = cache_dir
+
+        # (width, height) -> {"left": (map1, map2), "right": (map1, map2), "R1", "R2", "P1", "P2", "Q"}
+        self.maps = {}
+        self.lock = threading.Lock()
+
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="rectify")
+
+    @classmethod
+    def from_camera(cls, camera, left_camera_type, right_camera_type, img_size, **kwargs):
+        # From the "k", "d", "r", "t" calibration of a Camera, r and t of the right camera relative to the left one
+        left_params = camera.get_calibration_parameters(left_camera_type)
+        right_params = camera.get_calibration_parameters(right_camera_type)
+
+        return cls(left_params["k"], left_params.get("d", np.zeros(5)), right_params["k"], right_params.get("d", np.zeros(5)),
+                   right_params["r"], right_params["t"], img_size, **kwargs)
+
+    @classmethod
+    def from_kitti_raw(cls, calib_file, left_camera = "00", right_camera = "01", **kwargs):
+        calib = load_kitti_raw_calibration(calib_file, left_camera, right_camera)
+
+        return cls(calib["k_left"], calib["d_left"], calib["k_right"], calib["d_right"], calib["r"], calib["t"], calib["img_size"], **kwargs)
+
+    def get_calibration_hash(self, img_size):
+        calib_hash = hashlib.sha1()
+        for array in (self.k_left, self.d_left, self.k_right, self.d_right, self.r, self.t):
+            calib_hash.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        calib_hash.update(np.array(self.img_size + tuple(img_size) + (self.alpha,), dtype=np.float64).tobytes())
+
+        return calib_hash.hexdigest()
+
+    def get_maps(self, img_size):
+        img_size = tuple(int(v) for v in img_size)
+
+        with self.lock:
+            maps = self.maps.get(img_size)
+            if(maps is None):
+                maps = self._load_maps(img_size)
+                if(maps is None):
+                    maps = self._compute_maps(img_size)
+                    self._save_maps(img_size, maps)
+                self.maps[img_size] = maps
+
+        return maps
+
+    def _compute_maps(self, img_size):
+        # Intrinsics of a different resolution than the calibration are scaled to it
+        scale = np.diag([img_size[0] / self.img_size[0], img_size[1] / self.img_size[1], 1.0])
+        k_left = scale @ self.k_left
+        k_right = scale @ self.k_right
+
+        R1, R2, P1, P2, Q, _, _ = cv.stereoRectify(k_left, self.d_left, k_right, self.d_right, img_size, self.r, self.t,
+                                                   flags=cv.CALIB_ZERO_DISPARITY, alpha=self.alpha)
+
+        maps = {"R1": R1, "R2": R2, "P1": P1, "P2": P2, "Q": Q}
+        maps["left"] = cv.initUndistortRectifyMap(k_left, self.d_left, R1, P1, img_size, cv.CV_16SC2)
+        maps["right"] = cv.initUndistortRectifyMap(k_right, self.d_right, R2, P2, img_size, cv.CV_16SC2)
+
+        return maps
+
+    def _get_cache_file(self, img_size):
+        return os.path.join(self.cache_dir, f"rectify_{self.get_calibration_hash(img_size)}.npz")
+
+    def _load_maps(self, img_size):
+        if(not self.cache_dir):
+            return None
+
+        cache_file = self._get_cache_file(img_size)
+        if(not os.path.isfile(cache_file)):
+            return None
+
+        with np.load(cache_file) as f:
+            maps = {key: f[key] for key in ("R1", "R2", "P1", "P2", "Q")}
+            maps["left"] = (f["left_map1"], f["left_map2"])
+            maps["right"] = (f["right_map1"], f["right_map2"])
+
+        return maps
+
+    def _save_maps(self, img_size, maps):
+        if(not self.cache_dir):
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_file = self._get_cache_file(img_size)
+
+        # Write to a temporary file first so a reader never sees half written maps
+        tmp_file = cache_file + ".tmp"
+        try:
+            with open(tmp_file, "wb") as f:
+                np.savez(f, left_map1=maps["left"][0], left_map2=maps["left"][1], right_map1=maps["right"][0], right_map2=maps["right"][1],
+                         **{key: maps[key] for key in ("R1", "R2", "P1", "P2", "Q")})
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            print(f"Could not write the rectification maps {cache_file}")
+
+    def get_rectified_calib_params(self, img_size = None):
+        """"k", "r", "t" of the rectified left and right cameras, in the form Camera keeps them."""
+        maps = self.get_maps(self.img_size if img_size is None else img_size)
+        P1, P2 = maps["P1"], maps["P2"]
+
+        # The rectified right camera sits on the x axis of the left one
+        baseline = -P2[0, 3] / P2[0, 0]
+        left_params = {"k": P1[:3, :3].copy(), "r": np.eye(3), "t": np.array([[0.0], [0.0], [0.0]]), "d": np.zeros(5)}
+        right_params = {"k": P2[:3, :3].copy(), "r": np.eye(3), "t": np.array([[baseline], [0.0], [0.0]]), "d": np.zeros(5)}
+
+        return left_params, right_params
+
+    def rectify_img(self, img, side, interpolation = cv.INTER_LINEAR):
+        h, w = img.shape[:2]
+        map1, map2 = self.get_maps((w, h))[side]
+
+        return cv.remap(img, map1, map2, interpolation)
+
+    def rectify_frame(self, frame):
+        # Rectify the images of a frame dict in place, the remaps run in parallel
+        keys = [key for key in RECTIFIED_KEYS if frame.get(key) is not None]
+
+        def rectify(key):
+            interpolation = cv.INTER_NEAREST if key in NEAREST_KEYS else cv.INTER_LINEAR
+            return self.rectify_img(frame[key], RECTIFIED_KEYS[key], interpolation)
+
+        for key, img in zip(keys, self.executor.map(rectify, keys)):
+            frame[key] = img
+
+        return frame
+
+    def close(self):
+        self.executor.shutdown(wait=True)
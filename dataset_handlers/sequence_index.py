@@ -0,0 +1,149 @@
+import os
+import cv2 as cv
+import numpy as np
+
+IMG_FILE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+INDEX_FILE_SUFFIX = ".cv_gui_index.npz"
+
+
+class SequenceIndex:
+    """Sidecar index of an image folder.
+
+    It stores the sorted image files, the image dimensions and any array parsed from a file of the
+    sequence (timestamps, poses). The index is kept next to the folder (`<folder>.cv_gui_index.npz`)
+    so that writing it does not change the mtime of the folder, which is what invalidates it along with
+    the size and mtime of the first image (the one the dimensions come from). It is opt-in since it is
+    written into the dataset, which may be read-only or shared.
+    """
+    def __init__(self, dir):
+        self.dir = os.path.normpath(dir)
+        self.index_file = self.dir + INDEX_FILE_SUFFIX
+
+        self.dir_mtime = -1
+        self.files = []
+        self.img_shape = ()
+
+        # name -> (source file, source mtime, array)
+        self.arrays = {}
+        self.modified = False
+
+    def load(self):
+        # Returns False if there is no index or it is out of date
+        try:
+            dir_mtime = os.stat(self.dir).st_mtime_ns
+            with np.load(self.index_file, allow_pickle=False) as index:
+                index = dict(index)
+        except (OSError, ValueError):
+            return False
+
+        if("first_file_stat" not in index or int(index["dir_mtime"]) != dir_mtime):
+            return False
+
+        files = index["files"].tolist()
+        if(files and not np.array_equal(index["first_file_stat"], self._get_file_stat(files[0]))):
+            return False
+
+        self.dir_mtime = dir_mtime
+        self.files = files
+        self.img_shape = tuple(index["img_shape"].tolist())
+
+        self.arrays = {}
+        for key in index:
+            if(key.startswith("array_") and key.endswith("_data")):
+                name = key[len("array_"):-len("_data")]
+                self.arrays[name] = (str(index[f"array_{name}_source"]), int(index[f"array_{name}_mtime"]), index[key])
+
+        self.modified = False
+        return True
+
+    def build(self):
+        self.dir_mtime = os.stat(self.dir).st_mtime_ns
+
+        with os.scandir(self.dir) as it:
+            self.files = sorted(entry.name for entry in it if entry.name.endswith(IMG_FILE_EXTENSIONS) and entry.is_file())
+
+        # All the images of a sequence share the dimensions of the first one
+        self.img_shape = ()
+        if(self.files):
+            img = cv.imread(os.path.join(self.dir, self.files[0]), cv.IMREAD_UNCHANGED)
+            if(img is not None):
+                self.img_shape = img.shape
+
+        self.arrays = {}
+        self.modified = True
+
+    def _get_file_stat(self, file_name):
+        # (size, mtime) of an image, -1s if it is gone
+        try:
+            stat = os.stat(os.path.join(self.dir, file_name))
+        except OSError:
+            return np.array([-1, -1], dtype=np.int64)
+
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def save(self):
+        index = {"dir_mtime": np.int64(self.dir_mtime),
+                 "files": np.array(self.files, dtype=str),
+                 "first_file_stat": self._get_file_stat(self.files[0]) if self.files else np.empty(0, dtype=np.int64),
+                 "img_shape": np.array(self.img_shape, dtype=np.int64)}
+
+        for name, (source, mtime, array) in self.arrays.items():
+            index[f"array_{name}_source"] = np.array(source)
+            index[f"array_{name}_mtime"] = np.int64(mtime)
+            index[f"array_{name}_data"] = array
+
+        # Write to a temporary file first so a reader never sees a half written index
+        tmp_file = self.index_file + ".tmp"
+        try:
+            with open(tmp_file, "wb") as f:
+                np.savez(f, **index)
+            os.replace(tmp_file, self.index_file)
+        except OSError:
+            # Read-only storage, the index is rebuilt next time
+            print(f"Could not write the sequence index {self.index_file}")
+            return False
+
+        self.modified = False
+        return True
+
+    def get_img_files(self):
+        return [(self.dir + '/' + ff) for ff in self.files]
+
+    def get_array(self, name, source_file, loader):
+        # Array parsed from source_file, re-parsed with loader(source_file) when the file changes
+        try:
+            source_mtime = os.stat(source_file).st_mtime_ns
+        except OSError:
+            return loader(source_file)
+
+        source_file = os.path.abspath(source_file)
+        if(name in self.arrays):
+            source, mtime, array = self.arrays[name]
+            if(source == source_file and mtime == source_mtime):
+                return array
+
+        array = np.asarray(loader(source_file))
+        self.arrays[name] = (source_file, source_mtime, array)
+        self.modified = True
+
+        return array
+
+
+def get_sequence_index(dir):
+    # Load the index of dir, or build and save it if it is missing or out of date
+    index = SequenceIndex(dir)
+    if(not index.load()):
+        index.build()
+        index.save()
+
+    return index
+
+
+def get_img_files_from_dir(dir, use_index = False):
+    if(use_index):
+        return get_sequence_index(dir).get_img_files()
+
+    img_files = [(dir +'/'+ ff) for ff in os.listdir(dir) if ff.endswith(IMG_FILE_EXTENSIONS)]
+    img_files.sort()
+
+    return img_files
@@ -0,0 +1,137 @@
+import threading
+
+import cv2 as cv
+import numpy as np
+
+# StereoSGBM Parameters used by StereoCamera before the matchers were configurable
+DEFAULT_SAD_WINDOW = 6
+DEFAULT_SGBM_PARAMS = {"numDisparities": DEFAULT_SAD_WINDOW * 16,
+                       "minDisparity": 0,
+                       "blockSize": 11,
+                       "P1": 8 * 3 * DEFAULT_SAD_WINDOW ** 2,
+                       "P2": 32 * 3 * DEFAULT_SAD_WINDOW ** 2}
+
+DEFAULT_BM_PARAMS = {"numDisparities": DEFAULT_SAD_WINDOW * 16,
+                     "blockSize": 15}
+
+# Parameters each matcher takes. The SGBM mode is set by the matcher name
+SGBM_PARAM_NAMES = ("minDisparity", "numDisparities", "blockSize", "P1", "P2", "disp12MaxDiff", "preFilterCap",
+                    "uniquenessRatio", "speckleWindowSize", "speckleRange")
+BM_PARAM_NAMES = ("minDisparity", "numDisparities", "blockSize", "disp12MaxDiff", "preFilterCap", "preFilterSize",
+                  "preFilterType", "smallerBlockSize", "speckleRange", "speckleWindowSize", "textureThreshold", "uniquenessRatio")
+
+
+def _create_sgbm(mode):
+    return lambda **params: cv.StereoSGBM_create(mode=mode, **params)
+
+
+def _create_bm(numDisparities, blockSize, **params):
+    matcher = cv.StereoBM_create(numDisparities=numDisparities, blockSize=blockSize)
+
+    # StereoBM only takes the two parameters above in its constructor
+    for name, value in params.items():
+        getattr(matcher, f"set{name[0].upper()}{name[1:]}")(value)
+
+    return matcher
+
+
+# name -> (factory, default parameters, parameter names or None to take any)
+STEREO_MATCHERS = {
+    "sgbm_3way": (_create_sgbm(cv.STEREO_SGBM_MODE_SGBM_3WAY), DEFAULT_SGBM_PARAMS, SGBM_PARAM_NAMES),
+    "sgbm": (_create_sgbm(cv.STEREO_SGBM_MODE_SGBM), DEFAULT_SGBM_PARAMS, SGBM_PARAM_NAMES),
+    "sgbm_hh": (_create_sgbm(cv.STEREO_SGBM_MODE_HH), DEFAULT_SGBM_PARAMS, SGBM_PARAM_NAMES),
+    "sgbm_hh4": (_create_sgbm(cv.STEREO_SGBM_MODE_HH4), DEFAULT_SGBM_PARAMS, SGBM_PARAM_NAMES),
+    "bm": (_create_bm, DEFAULT_BM_PARAMS, BM_PARAM_NAMES),
+}
+
+DEFAULT_STEREO_MATCHER = "sgbm_3way"
+
+# Blank stereo pair check_stereo_matcher() computes on, bigger than any valid block size
+CHECK_IMG_SHAPE = (256, 512)
+
+# (name, parameters) -> matcher, the oldest are dropped past MAX_POOLED_MATCHERS per pool
+MAX_POOLED_MATCHERS = 8
+_matcher_pool = {}
+_matcher_pool_lock = threading.Lock()
+
+# The per-thread matchers live in the thread's own pool and go away with the thread. A pool from before the
+# last clear_stereo_matcher_pool() is dropped on its next use
+_thread_matchers = threading.local()
+_matcher_pool_generation = 0
+
+
+def register_stereo_matcher(name, factory, default_params = None, param_names = None):
+    # factory(**params) should return an object with compute(left_img, right_img) -> 16x fixed point disparity.
+    # param_names lists the parameters it takes, None takes any
+    STEREO_MATCHERS[name] = (factory, dict(default_params or {}), None if param_names is None else tuple(param_names))
+
+
+def get_stereo_matcher_params(name, **params):
+    # The default parameters of the matcher updated with params
+    assert name in STEREO_MATCHERS, f"Unknown stereo matcher {name}. Available: {list(STEREO_MATCHERS.keys())}"
+
+    param_names = STEREO_MATCHERS[name][2]
+    unknown = set(params) - set(param_names) if param_names is not None else set()
+    assert not unknown, f"Stereo matcher {name} has no parameters {sorted(unknown)}. Available: {list(param_names)}"
+
+    matcher_params = dict(STEREO_MATCHERS[name][1])
+    matcher_params.update(params)
+
+    return matcher_params
+
+
+def get_applicable_stereo_matcher_params(name, params):
+    # The parameters of params that matcher `name` takes, e.g. to keep them when switching matchers
+    assert name in STEREO_MATCHERS, f"Unknown stereo matcher {name}. Available: {list(STEREO_MATCHERS.keys())}"
+
+    param_names = STEREO_MATCHERS[name][2]
+    return {param_name: value for param_name, value in params.items() if param_names is None or param_name in param_names}
+
+
+def check_stereo_matcher(name, **params):
+    # Compute with a throwaway matcher on a blank pair, so invalid values (e.g. an even StereoBM blockSize) fail now
+    matcher_params = get_stereo_matcher_params(name, **params)
+    img = np.zeros(CHECK_IMG_SHAPE, dtype=np.uint8)
+    STEREO_MATCHERS[name][0](**matcher_params).compute(img, img)
+
+    return matcher_params
+
+
+def get_stereo_matcher(name = DEFAULT_STEREO_MATCHER, per_thread = False, **params):
+    """Matcher for the parameter set, created on first use and reused afterwards.
+
+    Matchers keep internal buffers, so threads that compute concurrently need per_thread=True.
+    """
+    matcher_params = get_stereo_matcher_params(name, **params)
+    key = (name, tuple(sorted(matcher_params.items())))
+
+    if(per_thread):
+        if(getattr(_thread_matchers, "generation", None) != _matcher_pool_generation):
+            _thread_matchers.pool = {}
+            _thread_matchers.generation = _matcher_pool_generation
+
+        return _get_pooled_matcher(_thread_matchers.pool, key, name, matcher_params)
+
+    with _matcher_pool_lock:
+        return _get_pooled_matcher(_matcher_pool, key, name, matcher_params)
+
+
+def _get_pooled_matcher(pool, key, name, matcher_params):
+    matcher = pool.get(key)
+    if(matcher is None):
+        matcher = STEREO_MATCHERS[name][0](**matcher_params)
+        pool[key] = matcher
+
+        # Every parameter change adds a matcher
+        while(len(pool) > MAX_POOLED_MATCHERS):
+            del pool[next(iter(pool))]
+
+    return matcher
+
+
+def clear_stereo_matcher_pool():
+    global _matcher_pool_generation
+
+    with _matcher_pool_lock:
+        _matcher_pool.clear()
+        _matcher_pool_generation += 1
@@ -0,0 +1,119 @@
+from collections import deque
+import os
+
+import numpy as np
+
+SEEK_INDEX_FILE_SUFFIX = ".cv_gui_seek.npz"
+
+
+class SVOSeekIndex:
+    """Sidecar index of an SVO file with the timestamp of every frame and the measured cost of seeking to frames.
+
+    Seeking in a compressed SVO decodes forward from the keyframe before the target, so a seek to a keyframe
+    costs about one grab while a seek to any other frame costs the whole run from its keyframe. Frames whose
+    seek cost was close to a plain grab are the cheap seek points. The index is filled as frames are grabbed
+    and seeks are done, and kept next to the file (`<svo>.cv_gui_seek.npz`). The size and mtime of the SVO
+    invalidate it.
+    """
+    def __init__(self, svo_file_path, frame_count, cheap_seek_factor = 2.0):
+        self.svo_file_path = svo_file_path
+        self.index_file = svo_file_path + SEEK_INDEX_FILE_SUFFIX
+        self.frame_count = frame_count
+
+        # A seek is cheap if it costs at most cheap_seek_factor grabs
+        self.cheap_seek_factor = cheap_seek_factor
+
+        self.timestamps = np.full(frame_count, np.nan, dtype=np.float64)
+        self.seek_costs = np.full(frame_count, np.nan, dtype=np.float32)
+
+        # Recent sequential grab times (without depth), the unit of the seek costs
+        self.grab_times = deque(maxlen=256)
+        self.grab_time = np.nan
+
+        self.modified = False
+
+    def _get_svo_stat(self):
+        stat = os.stat(self.svo_file_path)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def load(self):
+        # Returns False if there is no index or it is out of date
+        try:
+            svo_stat = self._get_svo_stat()
+            with np.load(self.index_file, allow_pickle=False) as index:
+                index = dict(index)
+        except (OSError, ValueError):
+            return False
+
+        if(not np.array_equal(index["svo_stat"], svo_stat) or len(index["timestamps"]) != self.frame_count):
+            return False
+
+        self.timestamps = index["timestamps"]
+        self.seek_costs = index["seek_costs"]
+        self.grab_time = float(index["grab_time"])
+        self.modified = False
+        return True
+
+    def save(self):
+        if(not self.modified):
+            return
+
+        # Write to a temporary file first so a reader never sees half an index
+        tmp_file = self.index_file + ".tmp"
+        try:
+            with open(tmp_file, "wb") as f:
+                np.savez(f, svo_stat=self._get_svo_stat(), timestamps=self.timestamps, seek_costs=self.seek_costs,
+                         grab_time=np.float64(self.get_grab_time()))
+            os.replace(tmp_file, self.index_file)
+            self.modified = False
+        except OSError:
+            print(f"Could not write the SVO seek index {self.index_file}")
+
+    def record_timestamp(self, idx, t):
+        if(0 <= idx < self.frame_count and self.timestamps[idx] != t):
+            self.timestamps[idx] = t
+            self.modified = True
+
+    def record_grab_time(self, seconds):
+        self.grab_times.append(seconds)
+
+    def record_seek_cost(self, idx, seconds):
+        # Time of the first grab after seeking to idx
+        if(0 <= idx < self.frame_count):
+            self.seek_costs[idx] = seconds
+            self.modified = True
+
+    def get_grab_time(self):
+        if(self.grab_times):
+            return float(np.median(self.grab_times))
+
+        return self.grab_time
+
+    def get_seek_points(self):
+        # Frames known to be cheap to seek to
+        grab_time = self.get_grab_time()
+        if(np.isnan(grab_time)):
+            return np.empty(0, dtype=np.int64)
+
+        return np.flatnonzero(self.seek_costs <= self.cheap_seek_factor * grab_time)
+
+    def get_seek_start(self, target, window):
+        """Frame to seek to before decoding forward to `target`: the last cheap seek point of the `window`
+        frames before it, or the start of the window."""
+        start = max(0, target - window)
+
+        seek_points = self.get_seek_points()
+        seek_points = seek_points[(seek_points >= start) & (seek_points <= target)]
+        if(len(seek_points) > 0):
+            return int(seek_points[-1])
+
+        return start
+
+    def get_frame_for_timestamp(self, t):
+        # Last recorded frame at or before t, None if no timestamp is known yet
+        known = np.flatnonzero(~np.isnan(self.timestamps))
+        if(len(known) == 0):
+            return None
+
+        position = np.searchsorted(self.timestamps[known], t, side="right") - 1
+        return int(known[max(position, 0)])
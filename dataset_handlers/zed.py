@@ -4,10 +4,18 @@ import cv2 as cv
 import numpy as np
 import pyzed.sl as sl
 import math
-import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 
 import cv_gui.utils.flags as cv_gui
+from cv_gui.dataset_handlers.proxy_cache import ProxyCache
+from cv_gui.dataset_handlers.rectifier import StereoRectifier
+from cv_gui.dataset_handlers.frame import LazyFrame
+from cv_gui.dataset_handlers.grab_producer import GrabProducer
+from cv_gui.dataset_handlers.svo_seek import SVOSeekIndex
+from cv_gui.utils.frame_cache import FrameCache
 
 class ZEDDepthUnit(Enum):
     METER = sl.UNIT.METER
@@ -29,16 +37,25 @@ class ZEDSensingMode(Enum):
     STANDARD = sl.SENSING_MODE.STANDARD
     FILL = sl.SENSING_MODE.FILL
 
+class ZEDColorFormat(Enum):
+    # Converted copy, BGR (8-8-8)
+    BGR = 0
+    # Zero-copy view of the sl.Mat, BGRA (8-8-8-8). Shown as cv_gui.IMAGE_TYPES.BGRA
+    BGRA = 1
+    # Zero-copy strided BGR view of the BGRA sl.Mat. Not contiguous, the GUI copies it to display it
+    BGR_VIEW = 2
+
 class ZED(StereoCamera):
     def __init__(self, resolution = ZEDResolution.HD2K, depth_mode = ZEDDepthMode.NEURAL, depth_unit = ZEDDepthUnit.MILLIMETER, svo_file_path = "", 
                  depth_min_dist = 0.15, depth_max_dist = 50, enable_pos_tracking = False, gray = True, color = True, label_path = "", use_rectified = True,
-                 seq_control_file = ""):
+                 seq_control_file = "", color_format = ZEDColorFormat.BGR, num_buffers = 1):
         super().__init__(dataset = cv_gui.DATASET_TYPE.ZED, seq_control_file=seq_control_file)
         self.zed = sl.Camera()
         
         self.gray = gray
         self.color = color
         self.use_rectified = use_rectified
+        self.color_format = color_format
         self.dataset_type = cv_gui.DATASET_TYPE.ZED
 
         # Create a InitParameters object and set configuration parameters
@@ -82,9 +99,48 @@ class ZED(StereoCamera):
         self.point_cloud = None
         self.confidence_img = None
         self.depth_color_image = None
+        
+        # Ring of buffer sets (one sl.Mat per view). With more than one set, the frame of a grab gets a set of its
+        # own that is only reused once every holder has released it, see acquire_frame() and release_frame()
+        self.num_buffers = num_buffers
+        self.buffer_sets = {}
+        self.buffer_refcounts = {}
+        self.buffer_set = None
+        self.buffer_condition = threading.Condition()
+        
+        # (width, height) to retrieve at instead of the camera resolution, see set_preview_resolution()
+        self.preview_resolution = None
+        self.sl_resolution = None
+        self.calibration_resolution = None
+        
+        # Frame index and resolution of the last grab
+        self.grab_index = None
+        self.grab_resolution = None
+        
+        # LazyFrame of the last grab, its producers read the SDK buffers of that grab
+        self.current_frame = None
+        
+        # Grab thread and bounded frame queue, see set_async_grab(). async_idx is the frame its next grab reads
+        self.grab_producer = None
+        self.async_idx = 0
+        
+        # SDK measures of the last grab, retrieved at most once per grab. prefetch_measures are retrieved with every grab
+        self.measures = {}
+        self.prefetch_measures = ()
+        
+        # SVO seek index and the images decoded around seeks, see enable_seek_index(). svo_position is the frame
+        # the next SDK grab reads, seek_frame_index the frame served from the seek cache
+        self.seek_index = None
+        self.seek_cache = None
+        self.seek_window = 0
+        self.svo_position = 0
+        self.seek_frame_index = None
 
         self.camera_open = False
         
+        # Threads used to decode the label images of a batch
+        self.batch_workers = 4
+        
     def set_from_svo_file(self, filepath):
         self.svo_file_path = filepath
         self.init_params.set_from_svo_file(filepath)
@@ -92,6 +148,47 @@ class ZED(StereoCamera):
     def set_label_folder(self, filepath):
         self.label_path = filepath
         
+    def set_num_buffers(self, num_buffers):
+        # Rings that are already allocated only grow
+        self.num_buffers = max(1, num_buffers)
+        
+    def set_prefetch_measures(self, measures = ()):
+        """Retrieve these SDK measures ("depth_img", "depth_color_img", "disparity_img", "confidence_img", "point_cloud")
+        with every grab instead of on first use, e.g. the ones a pipeline always reads."""
+        unknown = set(measures) - set(self._get_measure_retrievers())
+        assert not unknown, f"Unknown measures {unknown}"
+        
+        self.prefetch_measures = tuple(measures)
+        
+    def set_async_grab(self, queue_size = 2, policy = cv_gui.QUEUE_POLICY.BLOCK, measures = None):
+        """Grab and retrieve on a producer thread, up to `queue_size` frames ahead of the consumer. 0 turns it off.
+        
+        The queued frames are plain dicts with the images, the label and the prefetch measures (`measures`
+        replaces them), since nothing can be retrieved from a frame once the next one is grabbed.
+        """
+        self._stop_grab_producer()
+        self.grab_producer = None
+        if(queue_size <= 0):
+            return
+        
+        # The queued frames, the one being grabbed, the consumer's and the one on display each hold a buffer set
+        self.set_num_buffers(max(self.num_buffers, queue_size + 3))
+        if(measures is not None):
+            self.set_prefetch_measures(measures)
+        self.grab_producer = GrabProducer(self._grab_async_frame, self.release_frame, queue_size = queue_size, policy = policy,
+                                          wake = self._wake_buffer_waiters)
+        
+    def set_color_format(self, color_format):
+        # The zero-copy formats are views on the SDK buffers, they are overwritten by the next grab
+        self.color_format = color_format
+        
+    def get_color_img_type(self):
+        # IMAGE_TYPES to display the colour images with
+        if(self.color_format == ZEDColorFormat.BGRA):
+            return cv_gui.IMAGE_TYPES.BGRA
+        
+        return cv_gui.IMAGE_TYPES.BGR
+        
     def open_camera(self):
         # Open the camera
         err_code = self.zed.open(self.init_params)
@@ -106,44 +203,160 @@ class ZED(StereoCamera):
         if(self.seq_control_file != ""):
             self.process_seq_control_file(self.seq_control_file)
             
-        width = self.zed.get_camera_information().camera_resolution.width
-        height = self.zed.get_camera_information().camera_resolution.height
         # Set Camera frames 
-        self.left_image = sl.Mat(width, height, sl.MAT_TYPE.U8_C1)
-        self.right_image = sl.Mat(width, height, sl.MAT_TYPE.U8_C1)
-        self.left_image_color = sl.Mat(width, height, sl.MAT_TYPE.U8_C4)
-        self.right_image_color = sl.Mat(width, height, sl.MAT_TYPE.U8_C4)
-        self.depth_image = sl.Mat(width, height, sl.MAT_TYPE.F32_C1)
-        self.point_cloud = sl.Mat(width, height, sl.MAT_TYPE.F32_C4)
-        self.disparity_image = sl.Mat(width, height, sl.MAT_TYPE.F32_C1)
-        self.confidence_img = sl.Mat(width, height, sl.MAT_TYPE.F32_C1)
-        self.depth_color_image = sl.Mat(width, height, sl.MAT_TYPE.U8_C4)
+        self.buffer_sets = {}
+        self.buffer_refcounts = {}
+        self._use_buffer_set((self.get_retrieval_resolution(), 0))
 
         # Get and Update Calibration Matrix
-        self.set_calibration_parameters(camera_type=cv_gui.CAMERA_TYPE.LEFT_RGB, calib_params=self.get_calib_params(camera_type=cv_gui.CAMERA_TYPE.LEFT_RGB))
-        self.set_calibration_parameters(camera_type=cv_gui.CAMERA_TYPE.RIGHT_RGB, calib_params=self.get_calib_params(camera_type=cv_gui.CAMERA_TYPE.RIGHT_RGB))
+        self._update_calibration()
+        
+    def get_full_resolution(self):
+        resolution = self.zed.get_camera_information().camera_resolution
+        
+        return resolution.width, resolution.height
     
-    def get_img_files_from_dir(self, dir):
-        files = os.listdir(dir)
-        img_files = [(dir +'/'+ ff) for ff in files if (ff.endswith('.png') or ff.endswith('.jpg') or ff.endswith('.jpeg'))]
-        img_files.sort()
-
-        return img_files
+    def set_preview_resolution(self, width = 0, height = 0):
+        """Retrieve images and measures at (width, height) instead of the camera resolution, 0 turns it off.
+        
+        The intrinsics follow the resolution of the frames. Recording (see set_recording()) and
+        get_full_resolution_frame() always use the full resolution.
+        """
+        self.preview_resolution = (width, height) if width > 0 and height > 0 else None
+        
+    def get_retrieval_resolution(self):
+        if(self.preview_resolution is None or self.recording):
+            return self.get_full_resolution()
+        
+        return self.preview_resolution
+    
+    def _update_calibration(self, resolution = None):
+        # Intrinsics of `resolution`, by default the one the frames are retrieved at. After a grab it is
+        # the resolution of the buffer set, set_recording() may have changed the retrieval resolution since
+        resolution = self.get_retrieval_resolution() if resolution is None else resolution
+        if(resolution == self.calibration_resolution):
+            return
+        
+        if(self.rectifier is not None):
+            left_params, right_params = self.rectifier.get_rectified_calib_params(resolution)
+        else:
+            left_params = self.get_calib_params(camera_type=cv_gui.CAMERA_TYPE.LEFT_RGB, resolution=resolution)
+            right_params = self.get_calib_params(camera_type=cv_gui.CAMERA_TYPE.RIGHT_RGB, resolution=resolution)
+        self.set_calibration_parameters(camera_type=cv_gui.CAMERA_TYPE.LEFT_RGB, calib_params=left_params)
+        self.set_calibration_parameters(camera_type=cv_gui.CAMERA_TYPE.RIGHT_RGB, calib_params=right_params)
+        self.calibration_resolution = resolution
+        
+        if(self.base_camera_type is not None):
+            self.set_base_camera_type_for_intrinsics(self.base_camera_type)
     
+    def _get_buffer_ring(self, resolution):
+        # Buffer sets of one retrieval resolution, allocated on first use
+        ring = self.buffer_sets.setdefault(resolution, [])
+        refcounts = self.buffer_refcounts.setdefault(resolution, [])
+        if(len(ring) < self.num_buffers):
+            width, height = resolution
+            for _ in range(self.num_buffers - len(ring)):
+                ring.append({"left_image": sl.Mat(width, height, sl.MAT_TYPE.U8_C1),
+                             "right_image": sl.Mat(width, height, sl.MAT_TYPE.U8_C1),
+                             "left_image_color": sl.Mat(width, height, sl.MAT_TYPE.U8_C4),
+                             "right_image_color": sl.Mat(width, height, sl.MAT_TYPE.U8_C4),
+                             "depth_image": sl.Mat(width, height, sl.MAT_TYPE.F32_C1),
+                             "point_cloud": sl.Mat(width, height, sl.MAT_TYPE.F32_C4),
+                             "disparity_image": sl.Mat(width, height, sl.MAT_TYPE.F32_C1),
+                             "confidence_img": sl.Mat(width, height, sl.MAT_TYPE.F32_C1),
+                             "depth_color_image": sl.Mat(width, height, sl.MAT_TYPE.U8_C4)})
+                refcounts.append(0)
+            
+        return ring
+        
+    def _use_buffer_set(self, buffer_set):
+        # The retrieve calls write into the sl.Mat attributes
+        resolution, index = buffer_set
+        self.buffer_set = buffer_set
+        self.sl_resolution = sl.Resolution(*resolution)
+        for name, mat in self._get_buffer_ring(resolution)[index].items():
+            setattr(self, name, mat)
+            
+    def _select_buffer_set(self):
+        # Next buffer set nobody holds at the retrieval resolution, waits for a release if every set is held.
+        # False if the grab producer is stopped while it waits. The resolution is read once, see _update_calibration()
+        resolution = self.get_retrieval_resolution()
+        
+        with self.buffer_condition:
+            self._get_buffer_ring(resolution)
+            if(self.num_buffers == 1):
+                self._use_buffer_set((resolution, 0))
+                return True
+            
+            refcounts = self.buffer_refcounts[resolution]
+            last = self.buffer_set[1] if self.buffer_set[0] == resolution else -1
+            while(True):
+                for offset in range(1, self.num_buffers + 1):
+                    index = (last + offset) % self.num_buffers
+                    if(refcounts[index] == 0):
+                        self._use_buffer_set((resolution, index))
+                        return True
+                    
+                # The sets may be held outside the queue (display, consumer), stop() does not free them
+                if(self._is_grab_producer_stopping()):
+                    return False
+                self.buffer_condition.wait(timeout=0.1)
+                
+    def _is_grab_producer_stopping(self):
+        producer = self.grab_producer
+        return producer is not None and producer.stop_event.is_set() and threading.current_thread() is producer.thread
+    
+    def _wake_buffer_waiters(self):
+        with self.buffer_condition:
+            self.buffer_condition.notify_all()
+                
+    def _own_buffer_set(self, data):
+        # The frame handed out holds one reference, released with release_frame()
+        if(self.num_buffers == 1):
+            return
+        
+        resolution, index = self.buffer_set
+        with self.buffer_condition:
+            self.buffer_refcounts[resolution][index] += 1
+        data["buffer_set"] = self.buffer_set
+        
+    def acquire_frame(self, data):
+        """Keep the SDK buffers of a frame from being reused until a matching release_frame()."""
+        buffer_set = data.get("buffer_set")
+        if(buffer_set is None):
+            return
+        
+        resolution, index = buffer_set
+        with self.buffer_condition:
+            self.buffer_refcounts[resolution][index] += 1
+            
+    def release_frame(self, data):
+        buffer_set = data.get("buffer_set")
+        if(buffer_set is None):
+            return
+        
+        resolution, index = buffer_set
+        with self.buffer_condition:
+            self.buffer_refcounts[resolution][index] = max(0, self.buffer_refcounts[resolution][index] - 1)
+            self.buffer_condition.notify_all()
+            
     def set_runtime_parameters(self, sensing_mode = ZEDSensingMode.FILL, confidence_th = 100, textureness_confidence_th = 100):
         self.runtime_parameters.sensing_mode = sensing_mode.value  # Use sensing mode
         # Setting the depth confidence parameters
         self.runtime_parameters.confidence_threshold = confidence_th
         self.runtime_parameters.textureness_confidence_threshold = textureness_confidence_th
 
-    def get_calib_params(self, camera_type):
+    def get_calib_params(self, camera_type, raw = False, resolution = None):
+        # raw gives the calibration of the unrectified views, resolution (width, height) scales the intrinsics to it
         calib_params = {}
-        calibration_params = self.zed.get_camera_information().camera_configuration.calibration_parameters
+        camera_configuration = self.zed.get_camera_information().camera_configuration
+        calibration_params = camera_configuration.calibration_parameters_raw if raw else camera_configuration.calibration_parameters
         if(camera_type == cv_gui.CAMERA_TYPE.LEFT_RGB):
             fx = calibration_params.left_cam.fx
             fy = calibration_params.left_cam.fy
             cx = calibration_params.left_cam.cx
             cy = calibration_params.left_cam.cy
+            d = np.array(calibration_params.left_cam.disto)
             R = np.array([[0], [0], [0]])       # Identity Rotation as Left camera is the reference camera
             T = np.array([[0], [0], [0]])       # Null translation 
 
@@ -152,9 +365,15 @@ class ZED(StereoCamera):
             fy = calibration_params.right_cam.fy
             cx = calibration_params.right_cam.cx
             cy = calibration_params.right_cam.cy
+            d = np.array(calibration_params.right_cam.disto)
             R = calibration_params.R
             T = calibration_params.T
 
+        if(resolution is not None):
+            full_width, full_height = self.get_full_resolution()
+            fx, cx = fx * resolution[0] / full_width, cx * resolution[0] / full_width
+            fy, cy = fy * resolution[1] / full_height, cy * resolution[1] / full_height
+
         k = np.array([[fx, 0, cx],
                         [0, fy, cy],
                         [0, 0, 1]])
@@ -162,82 +381,390 @@ class ZED(StereoCamera):
         calib_params["k"] = k
         calib_params["r"] = R
         calib_params["t"] = T
+        calib_params["d"] = d
 
         return calib_params
         
     def get_next_stereo_images(self, gray = True, color = True):
         assert gray or color, "Either gray or color frag should be true"
         
+        if(self.grab_producer is not None):
+            return self._get_async_frame(gray, color)
+        
         self.gray = gray
         self.color = color
         
+        if(self.seek_cache is not None and not self.prefetch_measures):
+            data = self._get_seek_cache_frame(self.idx, gray, color)
+            if(data is not None):
+                self.idx = self.get_next_index(self.idx)
+                return cv_gui.ERROR.SUCCESS, data
+            
+        self.seek_frame_index = None
+        if(self.seek_index is not None and self.svo_position != self.idx):
+            # The seeks requested since the last grab are done here, as one
+            self._invalidate_current_frame()
+            self._seek_svo(self.idx, gray, color)
+        
+        self.measures = {}
+        status, data = self._grab_frame(self.idx, gray, color, self.lazy_frames, () if self.lazy_frames else self.prefetch_measures)
+        if(status != cv_gui.ERROR.SUCCESS):
+            return status, data
+        
+        if(self.seek_cache is not None and not self.lazy_frames):
+            self._put_seek_cache_imgs(data)
+        
+        if(self.lazy_frames):
+            # Through the measure getters, so they are memoized
+            data.retain(self.prefetch_measures)
+        else:
+            self.measures.update({key: data[key] for key in self.prefetch_measures})
+            
+        # update the frame count
+        self.idx = self.get_next_index(self.idx)
+        return cv_gui.ERROR.SUCCESS, data
+    
+    def _grab_frame(self, idx, gray, color, lazy, measures = ()):
+        # Grab frame `idx`, the SDK is expected to be positioned on it
         data = {}
 
+        self._invalidate_current_frame()
+        if(not self._select_buffer_set()):
+            return cv_gui.ERROR.FAILURE, data
+        self._update_calibration(self.buffer_set[0])
         err_code = self.zed.grab(self.runtime_parameters)
         # self.idx = self.get_next_index(self.idx)
         
         # err_code = self.grab(self.idx, self.runtime_parameters)
         if(err_code != sl.ERROR_CODE.SUCCESS):
             return cv_gui.ERROR.END_OF_FILE, data
+        self.svo_position = idx + 1
         
-        if(gray):
-            if(self.use_rectified):
-                # Retrieve left image
-                self.zed.retrieve_image(self.left_image, sl.VIEW.LEFT_GRAY)
-                # Retrieve left image
-                self.zed.retrieve_image(self.right_image, sl.VIEW.RIGHT_GRAY)
-            else:
-                # Retrieve left image
-                self.zed.retrieve_image(self.left_image, sl.VIEW.LEFT_UNRECTIFIED_GRAY)
-                # Retrieve left image
-                self.zed.retrieve_image(self.right_image, sl.VIEW.RIGHT_UNRECTIFIED_GRAY)
+        if(lazy):
+            data = self._get_lazy_frame(idx, gray, color)
+            self.current_frame = data
+        else:
+            self._retrieve_stereo_images(data, gray, color)
+            
+            if(self.label_path):
+                data['label_img'] = self._read_label_img(idx)
+                # cv.imshow("Seg", data['label_img'])
+                # cv.waitKey(0)
                 
+            measure_retrievers = self._get_measure_retrievers()
+            for key in measures:
+                data[key] = measure_retrievers[key]()
             
-            # Convert from zed data type to opencv data type
-            data['left_img'] = self.left_image.get_data()
-            data['right_img'] = self.right_image.get_data()
-
+        data['index'] = idx
+        self._own_buffer_set(data)
+        self.grab_index = idx
+        self.grab_resolution = self.buffer_set[0]
+        
+        data["t"] = self._get_grab_timestamp()
+        if(self.seek_index is not None):
+            self.seek_index.record_timestamp(idx, data["t"])
+        
+        # Proxies of an SVO are written from the frames as they are played
+        if(self.proxy_cache is not None):
+            self.proxy_cache.put(idx, data)
+            
+        return cv_gui.ERROR.SUCCESS, data
+    
+    def _grab_async_frame(self):
+        # Runs on the producer thread, which owns the frame plan cursor while it runs
+        status, data = self._grab_frame(self.async_idx, self.gray, self.color, False, self.prefetch_measures)
+        if(status == cv_gui.ERROR.SUCCESS):
+            self.async_idx = self.get_next_index(self.async_idx)
+            
+        return status, data, self.async_idx
+    
+    def _get_async_frame(self, gray, color):
+        if(self.grab_producer.thread is not None and (gray != self.gray or color != self.color)):
+            # Frames in the queue were retrieved for the other flags, start again from the consumer position
+            self.jump_to(self.idx)
+            
+        if(self.grab_producer.thread is None):
+            self.gray = gray
+            self.color = color
+            self.async_idx = self.idx
+            self._sync_svo_position()
+            self.grab_producer.start()
+            
+        status, data, next_idx = self.grab_producer.get()
+        self.measures = {}
+        if(status == cv_gui.ERROR.SUCCESS):
+            self.idx = next_idx
+            # The measure getters give the ones of the consumed frame
+            self.measures = {key: data[key] for key in self.prefetch_measures if key in data}
+            
+        return status, data
+    
+    def _get_grab_timestamp(self):
+        # Image timestamp of the last grab in seconds
+        return self.zed.get_timestamp(sl.TIME_REFERENCE.IMAGE).get_nanoseconds()*(1e-9)
+    
+    def _sync_svo_position(self):
+        # Seeks are deferred to the next grab while the seek index is enabled
+        if(self.svo_file_path != "" and self.svo_position != self.idx):
+            self.zed.set_svo_position(self.idx)
+            self.svo_position = self.idx
+    
+    def _stop_grab_producer(self):
+        # The SDK is used by one thread at a time
+        if(self.grab_producer is not None and self.grab_producer.thread is not None):
+            self.grab_producer.stop()
+            
+    def _get_measure_getters(self):
+        # Memoized for the frame of the last grab
+        return {"depth_img": self.get_depth_img,
+                "depth_color_img": self.get_depth_color_img,
+                "disparity_img": self.get_zed_disparity_img,
+                "confidence_img": self.get_zed_confidence_img,
+                "point_cloud": self.get_zed_point_cloud}
+    
+    def _get_measure_retrievers(self):
+        return {"depth_img": self._retrieve_depth_img,
+                "depth_color_img": self._retrieve_depth_color_img,
+                "disparity_img": self._retrieve_disparity_img,
+                "confidence_img": self._retrieve_confidence_img,
+                "point_cloud": self._retrieve_point_cloud}
+    
+    def _get_measure(self, key):
+        measure = self.measures.get(key)
+        if(measure is None):
+            assert self.grab_producer is None or self.grab_producer.thread is None, \
+                f"The grab producer has moved on, add {key} to set_prefetch_measures() to get it with the frames"
+            if(self.seek_frame_index is not None and self.grab_index != self.seek_frame_index):
+                # The images came from the seek cache, the SDK has to grab the frame for its measures
+                if(not self._grab_seek_frame(self.seek_frame_index)):
+                    return None
+            measure = self._get_measure_retrievers()[key]()
+            self.measures[key] = measure
+            
+        return measure
+    
+    def _get_lazy_frame(self, idx, gray, color):
+        """Frame whose images and measures are retrieved from the SDK when they are first read."""
+        frame = LazyFrame()
+        frame.volatile = True
+        
+        if(gray):
+            frame.set_producer(("left_img", "right_img"), self._retrieve_gray_imgs)
         if(color):
-            if(self.use_rectified):
-                # Retrieve left image
-                self.zed.retrieve_image(self.left_image_color, sl.VIEW.LEFT)
-                # Retrieve left image
-                self.zed.retrieve_image(self.right_image_color, sl.VIEW.RIGHT)
-            else:
-                # Retrieve left image
-                self.zed.retrieve_image(self.left_image_color, sl.VIEW.LEFT_UNRECTIFIED)
-                # Retrieve left image
-                self.zed.retrieve_image(self.right_image_color, sl.VIEW.RIGHT_UNRECTIFIED)
+            frame.set_producer(("left_color_img", "right_color_img"), self._retrieve_color_imgs)
+        if(self.label_path):
+            frame.set_producer("label_img", lambda: {"label_img": self._read_label_img(idx)})
+            
+        for key, getter in self._get_measure_getters().items():
+            frame.set_producer(key, lambda key = key, getter = getter: {key: getter()})
+        
+        return frame
+    
+    def _invalidate_current_frame(self):
+        # The SDK only has the data of the last grab, what was not read from the previous frame is gone
+        if(self.current_frame is not None):
+            if(self.seek_cache is not None):
+                self._put_seek_cache_imgs(self.current_frame)
+            self.current_frame.invalidate()
+            self.current_frame = None
+    
+    def _retrieve_stereo_images(self, data, gray, color):
+        if(gray):
+            data.update(self._retrieve_gray_imgs())
+        if(color):
+            data.update(self._retrieve_color_imgs())
+            
+    def _retrieve_gray_imgs(self):
+        data = {}
+        if(self.use_rectified):
+            # Retrieve left image
+            self.zed.retrieve_image(self.left_image, sl.VIEW.LEFT_GRAY, sl.MEM.CPU, self.sl_resolution)
+            # Retrieve left image
+            self.zed.retrieve_image(self.right_image, sl.VIEW.RIGHT_GRAY, sl.MEM.CPU, self.sl_resolution)
+        else:
+            # Retrieve left image
+            self.zed.retrieve_image(self.left_image, sl.VIEW.LEFT_UNRECTIFIED_GRAY, sl.MEM.CPU, self.sl_resolution)
+            # Retrieve left image
+            self.zed.retrieve_image(self.right_image, sl.VIEW.RIGHT_UNRECTIFIED_GRAY, sl.MEM.CPU, self.sl_resolution)
+            
+        # Convert from zed data type to opencv data type
+        data['left_img'] = self.left_image.get_data()
+        data['right_img'] = self.right_image.get_data()
+            
+        return self.rectify_frame(data)
+
+    def _retrieve_color_imgs(self):
+        data = {}
+        if(self.use_rectified):
+            # Retrieve left image
+            self.zed.retrieve_image(self.left_image_color, sl.VIEW.LEFT, sl.MEM.CPU, self.sl_resolution)
+            # Retrieve left image
+            self.zed.retrieve_image(self.right_image_color, sl.VIEW.RIGHT, sl.MEM.CPU, self.sl_resolution)
+        else:
+            # Retrieve left image
+            self.zed.retrieve_image(self.left_image_color, sl.VIEW.LEFT_UNRECTIFIED, sl.MEM.CPU, self.sl_resolution)
+            # Retrieve left image
+            self.zed.retrieve_image(self.right_image_color, sl.VIEW.RIGHT_UNRECTIFIED, sl.MEM.CPU, self.sl_resolution)
+            
+        # Convert from zed data type to opencv data type
+        data['left_color_img'] = self._get_color_data(self.left_image_color)
+        data['right_color_img'] = self._get_color_data(self.right_image_color)
+            
+        return self.rectify_frame(data)
+    
+    def _get_color_data(self, mat):
+        img = mat.get_data()
+        
+        if(self.color_format == ZEDColorFormat.BGRA):
+            return img
+        if(self.color_format == ZEDColorFormat.BGR_VIEW):
+            return img[:, :, :3]
+        
+        return cv.cvtColor(img, cv.COLOR_BGRA2BGR)
+    
+    def get_label_img_file(self, idx):
+        return f"{self.label_path}/Seq001Fr{str(idx).zfill(8)}M.jpeg"
+    
+    def _read_label_img(self, idx):
+        label_img = cv.imread(self.get_label_img_file(idx), 0)
+        
+        width, height = self.buffer_set[0]
+        if(label_img is not None and label_img.shape[:2] != (height, width)):
+            # Labels are class ids, they must not be interpolated
+            label_img = cv.resize(label_img, (width, height), interpolation=cv.INTER_NEAREST)
+            
+        return self.rectify_label_img(label_img)
+    
+    def get_proxy_frame(self, frame_number):
+        # Proxies are stored as BGR, they are shown with the colour format of the frames
+        data = super().get_proxy_frame(frame_number)
+        
+        if(data is not None and self.color_format == ZEDColorFormat.BGRA):
+            for key in ("left_color_img", "right_color_img"):
+                data[key] = cv.cvtColor(data[key], cv.COLOR_BGR2BGRA)
                 
-            # Convert from zed data type to opencv data type
-            data['left_color_img'] = cv.cvtColor(self.left_image_color.get_data(), cv.COLOR_BGRA2BGR)
-            data['right_color_img'] = cv.cvtColor(self.right_image_color.get_data(), cv.COLOR_BGRA2BGR)
+        return data
+    
+    def _read_proxy_label_img(self, frame_number):
+        if(not self.label_path):
+            return None
+        
+        return self._read_label_img(frame_number)
+    
+    def get_full_resolution_frame(self, data):
+        """Images of `data` retrieved again at the full resolution while previewing, None if `data` already has them.
+        
+        Only works until the next grab. The frame holds its buffer set, see release_frame().
+        """
+        if(self.grab_producer is not None and self.grab_producer.thread is not None):
+            # The producer has grabbed further
+            return None
+        if(data.get("index") is None or data.get("index") != self.grab_index or self.grab_resolution == self.get_full_resolution()):
+            return None
+        
+        preview_buffer_set = self.buffer_set
+        preview_resolution = self.preview_resolution
+        self.preview_resolution = None
+        try:
+            self._select_buffer_set()
             
-        if(self.label_path):
-            data['label_img'] = cv.imread(f"{self.label_path}/Seq001Fr{str(self.idx).zfill(8)}M.jpeg", 0)
-            # cv.imshow("Seg", data['label_img'])
-            # cv.waitKey(0)
+            frame = {"index": data["index"]}
+            self._retrieve_stereo_images(frame, "left_img" in data, "left_color_img" in data)
+            if(self.label_path):
+                frame["label_img"] = self._read_label_img(data["index"])
+            self._own_buffer_set(frame)
+        finally:
+            # The lazy producers of the previewed frame keep retrieving into its own buffers
+            self.preview_resolution = preview_resolution
+            self._use_buffer_set(preview_buffer_set)
             
-        data['index'] = self.idx
+        if("t" in data):
+            frame["t"] = data["t"]
+            
+        return frame
+    
+    def get_stereo_batch(self, start, count, stride = 1, gray = True, color = True):
+        # The SDK decodes one frame at a time, so the frames are grabbed in order and copied into the batch.
+        # Only the label images are decoded in parallel. The playback position is left after the batch.
+        assert gray or color, "Either gray or color frag should be true"
         
-        data["t"] = self.zed.get_timestamp(sl.TIME_REFERENCE.IMAGE).get_nanoseconds()*(1e-9)  # Get the image timestamp in seconds
-        # update the frame count
-        self.idx = self.get_next_index(self.idx)
-        return cv_gui.ERROR.SUCCESS, data
+        indices = np.arange(start, min(start + count * stride, self.get_frame_count()), stride)
+        if(len(indices) == 0):
+            return cv_gui.ERROR.END_OF_FILE, {}
+        
+        self._stop_grab_producer()
+        self._invalidate_current_frame()
+        self._select_buffer_set()
+        self._update_calibration(self.buffer_set[0])
+        self.measures = {}
+        
+        self.seek_frame_index = None
+        self.grab_index = None
+        
+        batch = {"t": np.empty(len(indices))}
+        for i, idx in enumerate(indices):
+            if(i == 0 or stride != 1):
+                self.zed.set_svo_position(int(idx))
+                
+            self.svo_position = None
+            if(self.zed.grab(self.runtime_parameters) != sl.ERROR_CODE.SUCCESS):
+                indices = indices[:i]
+                break
+            self.svo_position = int(idx) + 1
+            
+            frame = {}
+            self._retrieve_stereo_images(frame, gray, color)
+            
+            for key, img in frame.items():
+                if(key not in batch):
+                    batch[key] = np.empty((len(indices),) + img.shape, dtype=img.dtype)
+                batch[key][i] = img
+                
+            batch["t"][i] = self._get_grab_timestamp()
+            
+        if(len(indices) == 0):
+            return cv_gui.ERROR.END_OF_FILE, {}
+            
+        # Drop the slots of the frames that could not be grabbed
+        for key in batch:
+            batch[key] = batch[key][:len(indices)]
+        batch["index"] = indices
+        
+        if(self.label_path):
+            with ThreadPoolExecutor(max_workers=self.batch_workers) as executor:
+                batch["label_img"] = np.stack(list(executor.map(self._read_label_img, indices)))
+        
+        self.idx = int(indices[-1]) + 1
+            
+        return cv_gui.ERROR.SUCCESS, batch
     
     def grab(self, idx, runtime_params):
+        self._stop_grab_producer()
+        self._invalidate_current_frame()
+        self.measures = {}
         self.jump_to(idx)
+        self._sync_svo_position()
+        self.seek_frame_index = None
+        self.grab_index = None
+        
         err_code = self.zed.grab(runtime_params)
+        self.svo_position = idx + 1 if err_code == sl.ERROR_CODE.SUCCESS else None
         
         return err_code
     
     def get_depth_img(self):
+        return self._get_measure("depth_img")
+    
+    def _retrieve_depth_img(self):
         # Retrieve depth map. Depth is aligned on the left image
-        self.zed.retrieve_measure(self.depth_image, sl.MEASURE.DEPTH)
+        self.zed.retrieve_measure(self.depth_image, sl.MEASURE.DEPTH, sl.MEM.CPU, self.sl_resolution)
         return self.depth_image.get_data()
     
     def get_depth_color_img(self):
-        self.zed.retrieve_image(self.depth_color_image, sl.VIEW.DEPTH)
+        return self._get_measure("depth_color_img")
+    
+    def _retrieve_depth_color_img(self):
+        self.zed.retrieve_image(self.depth_color_image, sl.VIEW.DEPTH, sl.MEM.CPU, self.sl_resolution)
         return self.depth_color_image.get_data()
         
     def get_translation(self):
@@ -256,32 +783,259 @@ class ZED(StereoCamera):
         return np.array([[tx], [ty], [tz]])
     
     def get_zed_disparity_img(self):
+        return self._get_measure("disparity_img")
+    
+    def _retrieve_disparity_img(self):
         # Retrieve depth map. Depth is aligned on the left image
-        self.zed.retrieve_measure(self.disparity_image, sl.MEASURE.DISPARITY)
+        self.zed.retrieve_measure(self.disparity_image, sl.MEASURE.DISPARITY, sl.MEM.CPU, self.sl_resolution)
         return self.disparity_image.get_data()
 
     def get_zed_point_cloud(self):
-        self.zed.retrieve_measure(self.point_cloud, sl.MEASURE.XYZRGBA)
+        return self._get_measure("point_cloud")
+    
+    def _retrieve_point_cloud(self):
+        self.zed.retrieve_measure(self.point_cloud, sl.MEASURE.XYZRGBA, sl.MEM.CPU, self.sl_resolution)
         return self.point_cloud.get_data()
 
     def get_zed_confidence_img(self):
+        return self._get_measure("confidence_img")
+    
+    def _retrieve_confidence_img(self):
         # Retrieve depth map. Depth is aligned on the left image
-        self.zed.retrieve_measure(self.confidence_img, sl.MEASURE.CONFIDENCE)
+        self.zed.retrieve_measure(self.confidence_img, sl.MEASURE.CONFIDENCE, sl.MEM.CPU, self.sl_resolution)
         return self.confidence_img.get_data()
 
+    def enable_rectification(self, cache_dir = "", alpha = 0):
+        """Rectify the unrectified views (use_rectified = False) with OpenCV instead of the SDK."""
+        assert not self.use_rectified, "The SDK already rectifies the images, create the camera with use_rectified = False"
+        
+        if(cache_dir == "" and self.svo_file_path != ""):
+            cache_dir = self.svo_file_path + ".rectify"
+            
+        left_params = self.get_calib_params(cv_gui.CAMERA_TYPE.LEFT_RGB, raw = True)
+        right_params = self.get_calib_params(cv_gui.CAMERA_TYPE.RIGHT_RGB, raw = True)
+        
+        # The SDK gives the rotation as a Rodrigues vector and the position of the right camera in the left
+        # camera frame, stereoRectify wants the transform of points from the left to the right camera
+        R = cv.Rodrigues(np.asarray(right_params["r"], dtype=np.float64).reshape(3, 1))[0]
+        T = -R @ np.asarray(right_params["t"], dtype=np.float64).reshape(3, 1)
+        
+        resolution = self.zed.get_camera_information().camera_resolution
+        rectifier = StereoRectifier(left_params["k"], left_params["d"], right_params["k"], right_params["d"], R, T,
+                                    (resolution.width, resolution.height), alpha = alpha, cache_dir = cache_dir)
+        self.set_rectifier(rectifier, cv_gui.CAMERA_TYPE.LEFT_RGB, cv_gui.CAMERA_TYPE.RIGHT_RGB)
+        
+        # Rectified intrinsics of the retrieval resolution
+        self.calibration_resolution = None
+        self._update_calibration()
+        
+        return rectifier
+    
+    def enable_proxies(self, levels = (2, 4), preview_level = 2, proxy_dir = ""):
+        # The SDK handle cannot be shared with a background reader, so the proxies are written
+        # from the frames that get played
+        assert self.svo_file_path != "", "SVO File Path is not set"
+        
+        if(proxy_dir == ""):
+            proxy_dir = self.svo_file_path + ".proxies"
+            
+        self.close_proxies()
+        self.proxy_cache = ProxyCache(proxy_dir, levels = levels, preview_level = preview_level)
+        
+    def enable_seek_index(self, window = 15, cache_bytes = 512 * 1024 * 1024, scan = True, probe_stride = None):
+        """Seek through an index of the SVO and keep the decoded images around the seek target, so stepping back is cheap.
+        
+        jump_to() only moves the playback position and the seek is done by the next grab, so a run of seeks
+        costs one. A seek decodes forward from the last cheap seek point of the `window` frames before the
+        target and caches the images of those frames, and of the played frames, in up to `cache_bytes`.
+        Without an index next to the SVO, the file is scanned first (`scan`) for the frame timestamps and the
+        seek cost of every `probe_stride` frames (the window by default).
+        """
+        assert self.svo_file_path != "", "SVO File Path is not set"
+        
+        self._stop_grab_producer()
+        self.seek_window = window
+        self.seek_cache = FrameCache(max_bytes = cache_bytes)
+        self.seek_index = SVOSeekIndex(self.svo_file_path, self.get_frame_count())
+        if(not self.seek_index.load() and scan):
+            self.build_seek_index(window if probe_stride is None else probe_stride)
+            
+        return self.seek_index
+    
+    def build_seek_index(self, probe_stride = 0):
+        # Decodes the whole file once for the timestamps, then times a seek to every probe_stride frames
+        assert self.seek_index is not None, "Enable the seek index first, see enable_seek_index()"
+        
+        self._stop_grab_producer()
+        self._invalidate_current_frame()
+        self.measures = {}
+        self.seek_frame_index = None
+        self.grab_index = None
+        decode_parameters = self._get_decode_parameters()
+        
+        self.zed.set_svo_position(0)
+        for idx in range(self.seek_index.frame_count):
+            start = time.perf_counter()
+            if(self.zed.grab(decode_parameters) != sl.ERROR_CODE.SUCCESS):
+                break
+            self.seek_index.record_grab_time(time.perf_counter() - start)
+            self.seek_index.record_timestamp(idx, self._get_grab_timestamp())
+            
+        if(probe_stride > 0):
+            for idx in range(0, self.seek_index.frame_count, probe_stride):
+                self.zed.set_svo_position(idx)
+                start = time.perf_counter()
+                if(self.zed.grab(decode_parameters) == sl.ERROR_CODE.SUCCESS):
+                    self.seek_index.record_seek_cost(idx, time.perf_counter() - start)
+                    
+        self.svo_position = None
+        self.seek_index.save()
+    
+    def _get_decode_parameters(self):
+        # Grabs that only decode the images, the frames skipped over by a seek need no depth
+        decode_parameters = sl.RuntimeParameters()
+        decode_parameters.enable_depth = False
+        
+        return decode_parameters
+    
+    def _seek_svo(self, target, gray, color):
+        """Position the SDK on frame `target`, caching the `gray`/`color` images of the frames decoded on the way."""
+        if(self.svo_position is not None and self.svo_position < target <= self.svo_position + self.seek_window):
+            # Decoding forward from the current position is cheaper than a seek
+            start = self.svo_position
+            seeked = False
+        else:
+            start = self.seek_index.get_seek_start(target, self.seek_window)
+            self.zed.set_svo_position(start)
+            self.svo_position = start
+            seeked = True
+            
+        if(start == target):
+            return
+        
+        self.measures = {}
+        self.grab_index = None
+        self._select_buffer_set()
+        self._update_calibration(self.buffer_set[0])
+        decode_parameters = self._get_decode_parameters()
+        for idx in range(start, target):
+            grab_start = time.perf_counter()
+            if(self.zed.grab(decode_parameters) != sl.ERROR_CODE.SUCCESS):
+                self.svo_position = None
+                return
+            grab_time = time.perf_counter() - grab_start
+            self.svo_position = idx + 1
+            
+            if(seeked and idx == start):
+                self.seek_index.record_seek_cost(idx, grab_time)
+            else:
+                self.seek_index.record_grab_time(grab_time)
+            self.seek_index.record_timestamp(idx, self._get_grab_timestamp())
+            
+            if(gray and self.seek_cache.get(self._get_seek_cache_key(idx, "gray", self.buffer_set[0])) is None):
+                self._put_seek_cache_imgs(self._retrieve_gray_imgs(), idx)
+            if(color and self.seek_cache.get(self._get_seek_cache_key(idx, "color", self.buffer_set[0])) is None):
+                self._put_seek_cache_imgs(self._retrieve_color_imgs(), idx)
+                
+    def _grab_seek_frame(self, idx):
+        # Grab frame idx again with depth, for the measures of a frame served from the seek cache
+        self._seek_svo(idx, False, False)
+        self._select_buffer_set()
+        self._update_calibration(self.buffer_set[0])
+        self.measures = {}
+        if(self.zed.grab(self.runtime_parameters) != sl.ERROR_CODE.SUCCESS):
+            self.svo_position = None
+            return False
+        
+        self.svo_position = idx + 1
+        self.grab_index = idx
+        self.grab_resolution = self.buffer_set[0]
+        return True
+    
+    def _get_seek_cache_key(self, idx, group, resolution = None):
+        # The cached images depend on how they are retrieved
+        resolution = self.get_retrieval_resolution() if resolution is None else resolution
+        return (idx, group, resolution, self.color_format, self.use_rectified, self.rectifier is not None)
+    
+    def _put_seek_cache_imgs(self, frame, idx = None):
+        # Owned copies of the images the frame has loaded, the SDK buffers are reused by later grabs
+        idx = frame.get("index") if idx is None else idx
+        if(idx is None):
+            return
+        
+        for group, keys in (("gray", ("left_img", "right_img")), ("color", ("left_color_img", "right_color_img"))):
+            loaded = all(frame.is_loaded(key) if isinstance(frame, LazyFrame) else key in frame for key in keys)
+            # Retrieved into the current buffer set, at its resolution
+            cache_key = self._get_seek_cache_key(idx, group, self.buffer_set[0])
+            if(loaded and cache_key not in self.seek_cache):
+                self.seek_cache.put(cache_key, {key: np.array(frame[key]) for key in keys})
+                
+    def _get_seek_cache_frame(self, idx, gray, color):
+        """Frame idx from the images in the seek cache, None if they are not all there.
+        
+        The measures are read by grabbing the frame again, see _get_measure().
+        """
+        imgs = {}
+        for group, enabled in (("gray", gray), ("color", color)):
+            if(enabled):
+                cached = self.seek_cache.get(self._get_seek_cache_key(idx, group))
+                if(cached is None):
+                    return None
+                # Copies, callbacks may draw on the frame
+                imgs.update({key: img.copy() for key, img in cached.items()})
+                
+        self._invalidate_current_frame()
+        frame = self._get_lazy_frame(idx, False, False)
+        frame.update(imgs)
+        frame["index"] = idx
+        if(not np.isnan(self.seek_index.timestamps[idx])):
+            frame["t"] = float(self.seek_index.timestamps[idx])
+            
+        self.seek_frame_index = idx
+        if(not self.lazy_frames):
+            # Plain frames get their label now, the measures come from the getters
+            frame.retain(("label_img",))
+            return dict(frame.loaded_items())
+        
+        self.current_frame = frame
+        return frame
+    
     def close(self):
+        self._stop_grab_producer()
+        if(self.seek_index is not None):
+            self.seek_index.save()
+        self.close_proxies()
+        self.close_rectifier()
         self.zed.close()
         
     def jump_to(self, frame_number):
+        # The producer restarts from frame_number (live cameras from the live frame) on the next get_next_stereo_images()
+        self._stop_grab_producer()
+        self.measures = {}
+        
         # Works only if the camera is open in SVO playback mode.
         if(self.svo_file_path == ""):
             return
         
         # Jump to the frame number. The next call to grab() will read the provided frame number.
-        self.zed.set_svo_position(frame_number)
+        # With the seek index the SDK is only moved by the next grab, see _seek_svo()
+        if(self.seek_index is None):
+            self.zed.set_svo_position(frame_number)
+            self.svo_position = frame_number
         
         # Update the index of the dataframe
         self.idx = frame_number
+        self.seek_frame_plan(frame_number)
+        
+    def jump_to_timestamp(self, t):
+        # Frame of the image timestamp t (seconds), needs the timestamps of the seek index
+        assert self.seek_index is not None, "Enable the seek index first, see enable_seek_index()"
+        
+        frame_number = self.seek_index.get_frame_for_timestamp(t)
+        if(frame_number is not None):
+            self.jump_to(frame_number)
+            
+        return frame_number
         
     def get_frame_count(self):
         # Works only if the camera is open in SVO playback mode.
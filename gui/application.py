@@ -1,5 +1,4 @@
 import sys
-import time
 
 from PySide6.QtCore import Slot
 import numpy as np
@@ -11,6 +10,7 @@ from PySide6.QtWidgets import (QApplication, QComboBox, QGroupBox, QSlider,
                                QLineEdit, QFormLayout, QScrollArea, QCheckBox)
 from cv_gui.gui.process import Process
 from cv_gui.utils.recorder import Recorder
+from cv_gui.dataset_handlers.cached_camera import CachedCamera
 
 import cv_gui.utils.flags as cv_gui
 from cv_gui.utils.config_file_handler import read_config_file, save_config_file
@@ -79,12 +79,18 @@ class Application(QMainWindow):
         self.process.updateFrame1.connect(self.setImage1)
         self.process.updateFrame2.connect(self.setImage2)
         self.process.updateTimestamp.connect(self.set_timestamp)
+        self.process.updateFrameIndex.connect(self.set_displayed_frame_index)
+        self.process.frameDisplayed.connect(self.set_displayed_frame)
         
         if(add_extra_image_window):
             self.process.updateFrame3.connect(self.setImage3)
             
         # Recorder
         self.data_recorder = Recorder()
+        
+        # Frame whose images are on display
+        self.displayed_frame = None
+        self.displayed_frame_index = None
 
     def reset(self):
         self.process.reset_process()
@@ -102,6 +108,8 @@ class Application(QMainWindow):
         if(self.add_plotter):
             self.plot_widget.reset()
         self.data_recorder.reset()
+        self.displayed_frame = None
+        self.displayed_frame_index = None
         
         
     def init_menu_bar(self):
@@ -180,6 +188,8 @@ class Application(QMainWindow):
         # Create widgets for images with save box
         self.image1 = ImageSaveWidget(on_save=self.on_save_image1)
         self.image2 = ImageSaveWidget(on_save=self.on_save_image2)
+        self.image1.set_on_auto_record(self.on_auto_record_state_change)
+        self.image2.set_on_auto_record(self.on_auto_record_state_change)
             
         # Multiple Images layout
         images_layout = QHBoxLayout()
@@ -188,6 +198,7 @@ class Application(QMainWindow):
         
         if(add_extra_image_window):
             self.image3 = ImageSaveWidget(on_save=self.on_save_image3)
+            self.image3.set_on_auto_record(self.on_auto_record_state_change)
             images_layout.addWidget(self.image3, 50)
         
         return images_layout
@@ -243,6 +254,7 @@ class Application(QMainWindow):
         self.video_control_widget.set_on_frame_jump(self.on_frame_jump)
         self.video_control_widget.set_on_slider_value_changed(self.on_slider_value_changed)
         self.video_control_widget.set_on_slider_moved(self.on_slider_moved)
+        self.video_control_widget.set_on_slider_scrubbed(self.on_slider_scrubbed)
         self.video_control_widget.set_on_next_frame(self.on_next_frame)
         self.video_control_widget.set_on_prev_frame(self.on_prev_frame)
                 
@@ -257,15 +269,34 @@ class Application(QMainWindow):
 
     @Slot()
     def on_save_image1(self, file_name):
-        self.data_recorder.save_figure(file_name, 1)
+        self.save_image(file_name, 1)
         
     @Slot()
     def on_save_image2(self, file_name):
-        self.data_recorder.save_figure(file_name, 2)
+        self.save_image(file_name, 2)
         
     @Slot()
     def on_save_image3(self, file_name):
-        self.data_recorder.save_figure(file_name, 3)
+        self.save_image(file_name, 3)
+        
+    def save_image(self, file_name, img_idx):
+        if(not self.process.isRunning()):
+            self.data_recorder.save_figure(file_name, img_idx)
+            return
+        
+        # The image on display is saved, the process thread may already be on a later frame. The camera is
+        # only used from there, it fetches a previewed frame again at the full resolution
+        img = {1: self.data_recorder.img1, 2: self.data_recorder.img2, 3: self.data_recorder.img3}[img_idx]
+        self.process.save_img(img_idx, img, self.displayed_frame_index, lambda img: self.data_recorder.save_figure(file_name, img_idx, img))
+            
+    def on_auto_record_state_change(self, state):
+        # Auto recorded frames are retrieved at the full resolution
+        if(self.process.camera is not None):
+            images = [self.image1, self.image2] + ([self.image3] if self.add_extra_image_window else [])
+            recording = any(image.image_save_widget.auto_record for image in images)
+            # The camera may be grabbing on the process thread, the change is made there
+            camera = self.process.camera
+            self.process.call(lambda: camera.set_recording(recording))
         
     def on_export_timestamp(self, file_name):
         self.data_recorder.save_timestamps(file_name)
@@ -289,6 +320,9 @@ class Application(QMainWindow):
                                   self.dataset_widget.seq_control_file,
                                   self.config_data)
         
+        # Auto record may have been ticked before the camera existed
+        self.on_auto_record_state_change(None)
+        
         # Set the frame count to Video Control GUI
         frame_count = self.process.camera.get_frame_count()
         self.video_control_widget.set_maximum_frame_count(frame_count)
@@ -308,11 +342,9 @@ class Application(QMainWindow):
         
         if(self.process.isRunning()):
             # Change the logic
-            self.process.close()
             self.status = False
-            self.process.terminate()
-        # Give time for the thread to finish
-        time.sleep(1)
+            self.process.stop_process()
+            self.process.close()
         
         self.close()
 
@@ -322,7 +354,7 @@ class Application(QMainWindow):
 
     @Slot()
     def on_play_pause(self, is_playing):
-        self.process.toggle_play_pause_state()
+        self.process.set_playing(is_playing)
         
     @Slot()
     def on_save_dir_selected(self, dir_name):
@@ -334,11 +366,16 @@ class Application(QMainWindow):
         # self.clear_plot()
         self.on_frame_jump_callback(frame_number)
         # Jump the frame number in thread
-        self.process.jump_to_frame(frame_number)
+        self.process.seek(frame_number)
     
     @Slot()
     def on_slider_value_changed(self, frame_number):
-        self.process.jump_to_frame(frame_number)
+        self.process.seek(frame_number)
+        
+    @Slot()
+    def on_slider_scrubbed(self, frame_number):
+        # Downscaled proxy while the slider is dragged, if the camera has one
+        self.process.preview(frame_number)
         
     @Slot()
     def on_slider_moved(self, frame_number):
@@ -351,13 +388,13 @@ class Application(QMainWindow):
         # Clear the plot
         # self.clear_plot()
         self.on_frame_jump_callback(frame_number)
-        # Jump the frame number in thread
-        self.process.jump_to_frame(frame_number)
+        # Step in thread, clicks made before the frame is shown add up
+        self.process.step(-1)
         
     @Slot()
     def on_next_frame(self, frame_number):
-        # Jump the frame number in thread
-        self.process.jump_to_frame(frame_number)
+        # Step in thread, clicks made before the frame is shown add up
+        self.process.step(1)
         
     @Slot()
     def on_file_name_prefix_checkbox_state_change(self, state):
@@ -398,6 +435,17 @@ class Application(QMainWindow):
         # Update the frame in UI
         self.image3.set_image(image, image_type, image_name, auto_update=self.process.is_playing, forcefully_save_img=forcefully_save_img)
         
+    @Slot(object)
+    def set_displayed_frame(self, data):
+        # The images on display (and in data_recorder) stay valid until the next frame is displayed
+        if(self.displayed_frame is not None and self.process.camera is not None):
+            self.process.camera.release_frame(self.displayed_frame)
+        self.displayed_frame = data
+        
+    @Slot(int)
+    def set_displayed_frame_index(self, frame_index):
+        self.displayed_frame_index = frame_index if frame_index >= 0 else None
+        
     @Slot(QImage)
     def set_timestamp(self, timestamp):
         # Update the frame in UI
@@ -436,7 +484,11 @@ class Application(QMainWindow):
         
         return np.convolve(data, kernel, mode='same')
         
-    def set_camera(self, camera):
+    def set_camera(self, camera, frame_cache_bytes = 0):
+        # Keep the recently decoded frames in memory for Prev/Next stepping and scrubbing
+        if(frame_cache_bytes > 0):
+            camera = CachedCamera(camera, max_bytes=frame_cache_bytes)
+            
         self.process.camera = camera
         
     def set_img1_callback(self, img_callback):
@@ -455,10 +507,20 @@ class Application(QMainWindow):
         self.process.send_data_to_camera = func
         
     def add_dynamic_parameter(self, parameter_name, on_parameter_set_callback):
-        self.dynamic_paramters[parameter_name] = DynamicParameterWidget(parameter_name=parameter_name, callback=on_parameter_set_callback)
+        # A paused frame is sent to the callbacks again with the new value
+        def on_parameter_set(value):
+            on_parameter_set_callback(value)
+            self.process.refresh()
+            
+        self.dynamic_paramters[parameter_name] = DynamicParameterWidget(parameter_name=parameter_name, callback=on_parameter_set)
         
         self.dynamic_parameters_layout.addRow(QLabel(parameter_name), self.dynamic_paramters[parameter_name])
 
+    def add_stereo_matcher_parameters(self, camera, param_names = ("matcher", "numDisparities", "blockSize", "P1", "P2", "downscale")):
+        # Configure the stereo matcher of the camera at runtime. The process thread computes with it, the change is made there
+        for param_name in param_names:
+            self.add_dynamic_parameter(param_name, lambda value, param_name=param_name: self.process.call(lambda: camera.set_stereo_matcher_param(param_name, value)))
+            
     def clear_plot(self):
         if(self.add_plotter):
             self.plot_widget.clear_plot()
@@ -1,4 +1,5 @@
-import sys
+from concurrent.futures import Future
+import queue
 import time
 from PySide6.QtCore import QThread, Signal
 import numpy as np
@@ -11,6 +12,10 @@ class Process(QThread):
     updateFrame2 = Signal(np.ndarray, cv_gui.IMAGE_TYPES, str, bool)
     updateFrame3 = Signal(np.ndarray, cv_gui.IMAGE_TYPES, str, bool)
     updateTimestamp= Signal(str)
+    # Index of the frame whose images follow, emitted before them
+    updateFrameIndex = Signal(int)
+    # Emitted after the images of a frame, the GUI holds the frame until the next one is displayed
+    frameDisplayed = Signal(object)
 
     def __init__(self, parent=None, add_extra_image_window = False):
         QThread.__init__(self, parent)
@@ -18,17 +23,24 @@ class Process(QThread):
         self.default_add_extra_image_window = add_extra_image_window
         self.add_extra_image_window = add_extra_image_window
         
-        self.do_nothing = True
         self.trained_file = None
         self.status = True
         self.cap = True
         self.current_frame_number = 0
         self.is_playing = False
+        self.at_eof = False
         self.current_img1 = None
         self.current_img2 = None
+        self.current_img3 = None
         self.tracking_mode = False
         self.data = {}
         
+        # (PROCESS_COMMAND, argument) from the GUI. The thread sleeps on it while there is nothing to play
+        self.commands = queue.Queue()
+        
+        # Minimum time between two frames while playing
+        self.frame_interval = 0.05
+        
         # Callbacks
         self.on_start = None
         self.on_eof = None
@@ -42,8 +54,8 @@ class Process(QThread):
         self.camera = None
         
     def reset_process(self):
-        self.do_nothing = True
-        self.requestInterruption()
+        # The thread must be gone before the camera is dropped
+        self.stop_process()
         self.camera = None
         self.add_extra_image_window = self.default_add_extra_image_window
         
@@ -52,67 +64,201 @@ class Process(QThread):
         self.cap = True
         self.current_frame_number = 0
         self.is_playing = False
+        self.at_eof = False
+        self.data = {}
         
     def start_process(self):
+        # Commands of a previous run are dropped
+        self.commands = queue.Queue()
+        self.at_eof = False
+        
         # Start the thread
         self.start()
-        self.do_nothing = False
+        
+    def stop_process(self):
+        # The thread finishes the frame or seek it is on (an SVO seek may take seconds) and stops. It is never
+        # terminated, that could kill it holding the GIL or inside the camera SDK
+        if(not self.isRunning()):
+            return
+        
+        self.post_command(cv_gui.PROCESS_COMMAND.STOP)
+        self.wait()
+        
+    def post_command(self, command, arg = None):
+        # Handled by the thread, the camera is only used from there
+        self.commands.put((command, arg))
         
     def run(self):
-        while self.status:
-            if(self.do_nothing):
-                time.sleep(0.001)
-                continue
-            self.status, data = self.camera.get_next_stereo_images()
-            # If no data is left
-            if(self.status == cv_gui.ERROR.END_OF_FILE):
-                self.on_eof()
-                while(not self.is_playing):
-                    time.sleep(0.001)
-                    
-                continue
-            # Update the frame number
-            self.current_frame_number = data["index"]
+        # The first frame is shown before play is pressed
+        self.show_next_frame()
+        next_frame_time = time.monotonic() + self.frame_interval
+        
+        while(True):
+            # Paused or at the end of the file, the thread sleeps until a command arrives
+            timeout = None
+            if(self.is_playing and not self.at_eof):
+                timeout = max(0, next_frame_time - time.monotonic())
+                
+            if(not self.handle_commands(self.get_commands(timeout))):
+                break
+            
+            if(self.is_playing and not self.at_eof and time.monotonic() >= next_frame_time):
+                self.show_next_frame()
+                next_frame_time = time.monotonic() + self.frame_interval
+        
+    def get_commands(self, timeout = None):
+        # Every queued command, waiting up to timeout (forever if None) for the first one
+        try:
+            commands = [self.commands.get(timeout=timeout) if timeout != 0 else self.commands.get_nowait()]
+        except queue.Empty:
+            return []
+        
+        while(True):
+            try:
+                commands.append(self.commands.get_nowait())
+            except queue.Empty:
+                return commands
             
-            # Store Data
-            self.data = data
+    def handle_commands(self, commands):
+        # Seeks, steps and previews in a row are coalesced to the frame of the last one. False on STOP
+        target = None
+        preview = None
+        refresh = False
+        shown = False
+        for command, arg in commands:
+            if(command == cv_gui.PROCESS_COMMAND.STOP):
+                return False
+            elif(command == cv_gui.PROCESS_COMMAND.PLAY):
+                self.is_playing = True
+                self.at_eof = False
+            elif(command == cv_gui.PROCESS_COMMAND.PAUSE):
+                self.is_playing = False
+            elif(command == cv_gui.PROCESS_COMMAND.SEEK):
+                target = arg
+                preview = None
+            elif(command == cv_gui.PROCESS_COMMAND.STEP):
+                target = self.clamp_frame_number((self.current_frame_number if target is None else target) + arg)
+                preview = None
+            elif(command == cv_gui.PROCESS_COMMAND.PREVIEW):
+                preview = arg
+            elif(command == cv_gui.PROCESS_COMMAND.REFRESH):
+                refresh = True
+            elif(command == cv_gui.PROCESS_COMMAND.SAVE):
+                # The frame the user had asked for when saving
+                shown = self.show_requested_frame(target, preview) or shown
+                target = None
+                preview = None
+                self.save_current_img(*arg)
+            elif(command == cv_gui.PROCESS_COMMAND.CALL):
+                self.run_call(*arg)
+                
+        shown = self.show_requested_frame(target, preview) or shown
+        if(refresh and not shown and self.data):
+            self.send_data_to_camera(self.data, old_frame = True)
+            self.update(data=self.data, old_frame = True)
             
-            # Send this data to process
-            self.send_data_to_camera(data, old_frame = False)
+        return True
+    
+    def show_requested_frame(self, target, preview):
+        # False if there was nothing to show
+        if(target is not None):
+            self.jump_to_frame(target)
+        if(preview is not None):
+            self.show_proxy_frame(preview)
             
-            # Update the frame
-            self.update(data=data)
-            time.sleep(0.05)
+        return target is not None or preview is not None
+    
+    def save_current_img(self, img_idx, img, frame_index, save, future):
+        # Runs on the thread. img is saved as emitted, unless it is the preview of the paused frame on display
+        try:
+            data = None
+            if(frame_index is not None and frame_index == self.data.get("index")):
+                data = self.get_full_resolution_frame()
+            if(data is None):
+                future.set_result(save(img))
+                return
             
-            # print(self.current_frame_number)
-            while(not self.is_playing):
-                # Do not send new data to the camera
-                # if(self.tracking_mode):
-                # Send this data to process
-                self.send_data_to_camera(self.data, old_frame = True)
-                # print("In While LOOP")
-                self.update(data=self.data, old_frame = True)
-                time.sleep(0.1)
-                # time.sleep(1)
-                continue
-        sys.exit(-1)
+            try:
+                future.set_result(save(self.get_img(data, img_idx)))
+            finally:
+                self.camera.release_frame(data)
+        except Exception as e:
+            print(f"Could not save image {img_idx}: {e}")
+            future.set_exception(e)
+    
+    def run_call(self, func, future):
+        try:
+            future.set_result(func())
+        except Exception as e:
+            # The thread keeps running, e.g. with the parameters from before a rejected change
+            print(f"Could not run {getattr(func, '__name__', func)}: {e}")
+            future.set_exception(e)
+            
+    def clamp_frame_number(self, frame_number):
+        return max(0, min(frame_number, self.camera.get_frame_count() - 1))
+            
+    def show_next_frame(self):
+        # The buffers of the previous frame can be reused by the camera
+        self.camera.release_frame(self.data)
+        self.data = {}
+        
+        self.status, data = self.camera.get_next_stereo_images()
+        # If no data is left
+        if(self.status == cv_gui.ERROR.END_OF_FILE):
+            self.at_eof = True
+            self.on_eof()
+            return
+        
+        # Update the frame number
+        self.current_frame_number = data["index"]
+        
+        # Store Data
+        self.data = data
+        
+        # Send this data to process
+        self.send_data_to_camera(data, old_frame = False)
+        
+        # Update the frame
+        self.update(data=data)
 
     def update(self, data = {}, old_frame = False):
         # Current image on display
         # self.current_img = data['left_img']
-        self.current_img1, img1_format_type, img1_name = self.img1_callback(data)
-        self.current_img2, img2_format_type, img2_name = self.img2_callback(data)
-        self.timestamp = self.timestamp_callback(data)
+        # All the callbacks run before anything is emitted, see show_proxy_frame()
+        img1, img1_format_type, img1_name = self.img1_callback(data)
+        img2, img2_format_type, img2_name = self.img2_callback(data)
+        timestamp = self.timestamp_callback(data)
+        if(self.add_extra_image_window):
+            img3, img3_format_type, img3_name = self.img3_callback(data)
+        
+        self.current_img1, self.current_img2, self.timestamp = img1, img2, timestamp
         # print(old_frame, img1_name)
         forcefully_save_img = not old_frame
         # Emit signal
+        self.updateFrameIndex.emit(data.get("index", -1))
         self.updateFrame1.emit(self.current_img1, img1_format_type, img1_name, forcefully_save_img)
         self.updateFrame2.emit(self.current_img2, img2_format_type, img2_name, forcefully_save_img)
         self.updateTimestamp.emit(self.timestamp)
         
         if(self.add_extra_image_window):
-            self.current_img3, img3_format_type, img3_name = self.img3_callback(data)
+            self.current_img3 = img3
             self.updateFrame3.emit(self.current_img3, img3_format_type, img3_name, forcefully_save_img)
+            
+        # The images are shown from the camera buffers, the GUI releases them
+        self.camera.acquire_frame(data)
+        self.frameDisplayed.emit(data)
+        
+    def get_full_resolution_frame(self):
+        # Current frame at the full resolution if only a preview of it is on display, while paused. Runs on the thread, see save_img()
+        if(self.is_playing or self.camera is None or not self.data):
+            return None
+        
+        return self.camera.get_full_resolution_frame(self.data)
+    
+    def get_img(self, data, img_idx):
+        img_callback = {1: self.img1_callback, 2: self.img2_callback, 3: self.img3_callback}[img_idx]
+        
+        return img_callback(data)[0]
         
     def get_img_dim(self, img):
         ch = 1
@@ -124,25 +270,78 @@ class Process(QThread):
         return h, w, ch
 
     def jump_to_frame(self, frame_number):
+        # Runs on the thread, see seek()
         self.camera.jump_to(frame_number)
         self.current_frame_number = frame_number
+        self.at_eof = False
         # Update the GUI if the player is paused
         if(not self.is_playing):
-            # Get the data
-            self.status, data = self.camera.get_next_stereo_images()
-            # Update the frame number
-            self.current_frame_number = data["index"]
-            # Store Data
-            self.data = data
-            # Send this data to process
-            self.send_data_to_camera(data, old_frame = False)
-            # print("Jump to frame")
-            # Update the GUI
-            self.update(data)
+            self.show_next_frame()
+
+    def show_proxy_frame(self, frame_number):
+        # While playing, or without a proxy for the frame, this is a normal jump
+        data = None
+        if(not self.is_playing and hasattr(self.camera, "get_proxy_frame")):
+            data = self.camera.get_proxy_frame(frame_number)
+            
+        if(data is None):
+            self.jump_to_frame(frame_number)
+            return
+        
+        # Only displayed, the proxy is not sent to the camera callbacks nor auto-saved.
+        # A proxy has no measures (see get_proxy_frame()), callbacks that show them get the full frame
+        try:
+            self.update(data, old_frame = True)
+        except KeyError:
+            self.jump_to_frame(frame_number)
+            return
+        
+        self.current_frame_number = frame_number
+        
+    def play(self):
+        self.post_command(cv_gui.PROCESS_COMMAND.PLAY)
+        
+    def pause(self):
+        self.post_command(cv_gui.PROCESS_COMMAND.PAUSE)
+        
+    def set_playing(self, is_playing):
+        self.play() if is_playing else self.pause()
+        
+    def seek(self, frame_number):
+        self.post_command(cv_gui.PROCESS_COMMAND.SEEK, frame_number)
+        
+    def step(self, num_frames = 1):
+        # Relative to the frame on display, negative steps go back
+        self.post_command(cv_gui.PROCESS_COMMAND.STEP, num_frames)
+        
+    def preview(self, frame_number):
+        self.post_command(cv_gui.PROCESS_COMMAND.PREVIEW, frame_number)
+        
+    def refresh(self):
+        self.post_command(cv_gui.PROCESS_COMMAND.REFRESH)
+        
+    def save_img(self, img_idx, img, frame_index, save):
+        """Call save(img) on the thread with the emitted image img_idx of frame frame_index. It is replaced by the
+        full resolution image if that frame is still on display, paused, as a preview. Returns a Future of what save returns."""
+        future = Future()
+        self.post_command(cv_gui.PROCESS_COMMAND.SAVE, (img_idx, img, frame_index, save, future))
+        
+        return future
+
+    def call(self, func):
+        """Run func() on the thread, in order with the commands posted before it, right away if the thread
+        is not running. Returns a Future of what func returns."""
+        future = Future()
+        if(self.isRunning()):
+            self.post_command(cv_gui.PROCESS_COMMAND.CALL, (func, future))
+        else:
+            self.run_call(func, future)
+            
+        return future
 
     def close(self):
         self.camera.close()
         
     def toggle_play_pause_state(self):
-        self.is_playing = not self.is_playing
+        self.set_playing(not self.is_playing)
     
\ No newline at end of file
@@ -1,5 +1,6 @@
-from PySide6.QtCore import Qt, Slot
+from PySide6.QtCore import Qt, Slot, QTimer
 import pyqtgraph as pg
+import numpy as np
 
 from PySide6.QtGui import QAction, QImage, QKeySequence, QPixmap, QIntValidator
 
@@ -46,6 +47,9 @@ class ImageNameSaveWidget(QWidget):
     def on_auto_record_checkbox_state_change_(self, state):
         self.auto_record = state
         
+        if(self.on_auto_record_checkbox_state_change is not None):
+            self.on_auto_record_checkbox_state_change(state)
+        
     @Slot()
     def on_save_(self):
         file_name = self.image_name_text_box.text()
@@ -76,7 +80,10 @@ class ImageWidget(QWidget):
     def set_image(self, img, img_format_type):
         # Creating and scaling QImage
         h, w, ch = self.get_img_dim(img)
-        qt_img = QImage(img.data, w, h, ch * w, img_format_type.value)
+        if(not img.flags.c_contiguous):
+            # e.g. a BGR view of a BGRA buffer, QImage needs packed pixels
+            img = np.ascontiguousarray(img)
+        qt_img = QImage(img.data, w, h, img.strides[0], img_format_type.value)
         scaled_img = qt_img.scaled(640, 480, Qt.KeepAspectRatio)
         
         self.image.setPixmap(QPixmap.fromImage(scaled_img))
@@ -112,6 +119,9 @@ class ImageSaveWidget(QWidget):
     def set_on_save(self, func):
         self.image_save_widget.set_on_save(func)
         
+    def set_on_auto_record(self, func):
+        self.image_save_widget.on_auto_record_checkbox_state_change = func
+        
     def set_image(self, img, img_format_type, image_name, auto_update = False, forcefully_save_img=False):
         self.image_widget.set_image(img, img_format_type)
         
@@ -246,6 +256,14 @@ class VideoControlWidget(QWidget):
         self.on_frame_jump = None
         self.on_slider_moved = None
         self.on_slider_value_changed = None
+        self.on_slider_scrubbed = None
+        self.slider_scrubbing = False
+        
+        # While the slider is dragged, the full frame is only requested once it stays still
+        self.slider_settle_timer = QTimer(self)
+        self.slider_settle_timer.setSingleShot(True)
+        self.slider_settle_timer.setInterval(200)
+        self.slider_settle_timer.timeout.connect(self.on_slider_settled_)
         
         self.frame_number_jump_button.clicked.connect(self.on_frame_jump_)
         self.play_pause_button.clicked.connect(self.on_play_pause_)
@@ -253,6 +271,7 @@ class VideoControlWidget(QWidget):
         self.next_frame_button.clicked.connect(self.on_next_frame_)
         self.slider.valueChanged.connect(self.on_slider_value_changed_)
         self.slider.sliderMoved.connect(self.on_slider_moved_)
+        self.slider.sliderReleased.connect(self.on_slider_settled_)
     
     def reset(self):        
         # Reset the variables
@@ -294,6 +313,9 @@ class VideoControlWidget(QWidget):
         
     def set_on_slider_value_changed(self, func):
         self.on_slider_value_changed = func
+        
+    def set_on_slider_scrubbed(self, func):
+        self.on_slider_scrubbed = func
 
     def set_pause(self):
         self.is_playing = False
@@ -326,8 +348,25 @@ class VideoControlWidget(QWidget):
         # Update the text
         self.set_frame_label(frame_number)
         
+        # Show a preview while dragging and request the full frame once the slider settles
+        if(self.slider.isSliderDown() and self.on_slider_scrubbed is not None):
+            self.slider_scrubbing = True
+            self.on_slider_scrubbed(frame_number)
+            self.slider_settle_timer.start()
+            return
+        
         self.on_slider_value_changed(frame_number)
         
+    @Slot()
+    def on_slider_settled_(self):
+        # Nothing to swap if no preview was shown since the last full frame
+        if(not self.slider_scrubbing):
+            return
+        
+        self.slider_scrubbing = False
+        self.slider_settle_timer.stop()
+        self.on_slider_value_changed(self.slider.value())
+        
     @Slot()
     def on_slider_moved_(self, frame_number):
         # Update the text
@@ -0,0 +1,69 @@
+import argparse
+import time
+
+from cv_gui.dataset_handlers.exporter import DatasetExporter
+
+
+def get_camera(args):
+    if(args.svo):
+        # pyzed is only needed for SVO files
+        from cv_gui.dataset_handlers.zed import ZED, ZEDColorFormat
+
+        camera = ZED(svo_file_path=args.svo, use_rectified=not args.unrectified, color_format=ZEDColorFormat.BGR_VIEW)
+        if(args.seq_control_file):
+            camera.set_seq_control_file(args.seq_control_file)
+        camera.set_runtime_parameters()
+        if(not camera.open_camera()):
+            raise RuntimeError(f"Could not open {args.svo}")
+        camera.init()
+
+        # Frames are grabbed while the previous ones are written, each queued or pending frame keeps its own buffers
+        camera.set_async_grab(queue_size=args.queue_size)
+        camera.set_num_buffers(args.queue_size + args.max_pending + 3)
+        return camera
+
+    from cv_gui.dataset_handlers.dataset_loader import DatasetLoader
+
+    camera = DatasetLoader(left_path=args.left, right_path=args.right, timestamp_file=args.timestamp_file, prefetch=args.queue_size)
+    if(args.seq_control_file):
+        camera.set_seq_control_file(args.seq_control_file)
+    camera.init()
+    return camera
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the left and right images of an SVO file (or an image dataset) without the GUI")
+    parser.add_argument("output_dir", help="Folder the images and the timestamps are written to")
+    parser.add_argument("--svo", default="", help="SVO file")
+    parser.add_argument("--left", default="", help="Left image folder, when exporting an image dataset")
+    parser.add_argument("--right", default="", help="Right image folder, when exporting an image dataset")
+    parser.add_argument("--timestamp_file", default="", help="Timestamps of the image dataset")
+    parser.add_argument("--seq_control_file", default="", help="Only export the frames selected by this file")
+    parser.add_argument("--unrectified", action="store_true", help="Export the unrectified SVO images")
+    parser.add_argument("--gray", action="store_true", help="Export grayscale images")
+    parser.add_argument("--ext", default="jpeg", help="Image file extension, e.g. jpeg or png")
+    parser.add_argument("--start", type=int, default=0, help="First frame")
+    parser.add_argument("--count", type=int, default=None, help="Number of frames, all by default")
+    parser.add_argument("--writers", type=int, default=None, help="Writer threads, one per CPU by default")
+    parser.add_argument("--max_pending", type=int, default=16, help="Frames waiting to be written at most")
+    parser.add_argument("--queue_size", type=int, default=4, help="Frames read ahead of the writers")
+    args = parser.parse_args()
+
+    assert args.svo or (args.left and args.right), "Give either --svo or --left and --right"
+
+    camera = get_camera(args)
+    exporter = DatasetExporter(camera, args.output_dir, num_writers=args.writers, max_pending=args.max_pending, ext=args.ext, color=not args.gray)
+
+    start_time = time.time()
+    try:
+        num_frames = exporter.export(start=args.start, count=args.count)
+    finally:
+        exporter.close()
+        camera.close()
+
+    elapsed = time.time() - start_time
+    print(f"Exported {num_frames} frames to {args.output_dir} in {elapsed:.1f}s ({num_frames / max(elapsed, 1e-6):.1f} fps)")
+
+
+if __name__ == "__main__":
+    main()
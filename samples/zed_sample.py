@@ -43,11 +43,11 @@ class ZEDGUISample:
     
     def return_left_image(self, data):
         file_name = f"Seq001Fr{str(data['index']).zfill(8)}L"
-        return data['left_color_img'], cv_gui.IMAGE_TYPES.BGR, file_name
+        return data['left_color_img'], self.camera.get_color_img_type(), file_name
         
     def return_right_image(self, data):
         file_name = f"Seq001Fr{str(data['index']).zfill(8)}R"
-        return data['right_color_img'], cv_gui.IMAGE_TYPES.BGR, file_name
+        return data['right_color_img'], self.camera.get_color_img_type(), file_name
 
     def on_zed_start(self, filepath, label_path = "", config_file = ""):
         print(label_path)
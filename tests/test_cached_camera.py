@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+import cv_gui.utils.flags as cv_gui
+from cv_gui.dataset_handlers.cached_camera import CachedCamera
+from cv_gui.dataset_handlers.frame import LazyFrame
+
+
+class SequenceCamera:
+    # Frame idx is an image filled with idx, decoded into a fresh array
+    def __init__(self, frame_count = 5, lazy = False):
+        self.frame_count = frame_count
+        self.lazy = lazy
+        self.idx = 0
+        self.decodes = 0
+        self.decode_scale = 1
+        
+    def _decode(self, idx):
+        self.decodes += 1
+        return {"left_color_img": np.full((4 // self.decode_scale, 6 // self.decode_scale, 3), idx, dtype=np.uint8)}
+        
+    def set_decode_scale(self, decode_scale):
+        self.decode_scale = decode_scale
+        
+    def get_next_stereo_images(self, gray = True, color = True):
+        if(self.idx >= self.frame_count):
+            return cv_gui.ERROR.END_OF_FILE, {}
+        
+        idx = self.idx
+        if(self.lazy):
+            data = LazyFrame({"index": idx})
+            data.set_producer("left_color_img", lambda: self._decode(idx))
+            # Derived from the colour image of the frame, like the gray images of DatasetLoader
+            data.set_producer("left_img", lambda: {"left_img": data["left_color_img"][:, :, 0].copy()})
+        else:
+            data = dict(self._decode(idx), index=idx)
+            
+        self.idx += 1
+        return cv_gui.ERROR.SUCCESS, data
+    
+    def get_next_index(self, idx):
+        return idx + 1
+    
+    def seek_frame_plan(self, frame_number):
+        pass
+    
+    def jump_to(self, frame_number):
+        self.idx = frame_number
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_drawing_on_returned_frames_does_not_change_the_cache(lazy):
+    camera = SequenceCamera(lazy = lazy)
+    cached_camera = CachedCamera(camera)
+    
+    # Miss, drawn on in place like the GUI callbacks do
+    _, data = cached_camera.get_next_stereo_images()
+    data["left_color_img"][:] = 255
+    cached_camera.get_next_stereo_images()[1]["left_color_img"]
+    
+    # Hit, drawn on as well
+    cached_camera.jump_to(0)
+    _, data = cached_camera.get_next_stereo_images()
+    assert (data["left_color_img"] == 0).all()
+    data["left_color_img"][:] = 255
+    
+    cached_camera.jump_to(0)
+    _, data = cached_camera.get_next_stereo_images()
+    assert (data["left_color_img"] == 0).all()
+    assert camera.decodes == 2
+
+
+def test_derived_values_do_not_read_what_callbacks_drew():
+    camera = SequenceCamera(lazy = True)
+    cached_camera = CachedCamera(camera)
+    
+    _, data = cached_camera.get_next_stereo_images()
+    data["left_color_img"][:] = 255
+    assert (data["left_img"] == 0).all()
+    
+    cached_camera.get_next_stereo_images()
+    cached_camera.jump_to(0)
+    _, data = cached_camera.get_next_stereo_images()
+    assert (data["left_img"] == 0).all()
+    assert camera.decodes == 1
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_frame_setters_clear_the_cache(lazy):
+    camera = SequenceCamera(lazy = lazy)
+    cached_camera = CachedCamera(camera)
+    
+    cached_camera.get_next_stereo_images()[1]["left_color_img"]
+    cached_camera.set_decode_scale(2)
+    cached_camera.jump_to(0)
+    _, data = cached_camera.get_next_stereo_images()
+    assert data["left_color_img"].shape == (2, 3, 3)
+    assert camera.decodes == 2
@@ -0,0 +1,63 @@
+import cv2 as cv
+import numpy as np
+
+from cv_gui.dataset_handlers.stereo_camera import StereoCamera, get_subpix_patches
+
+
+def get_rect_subpix(img, patch_size, center):
+    # getRectSubPix with OpenCV's own arithmetic, IPP builds sample single channel uint8 images with IPP
+    if(img.ndim == 2):
+        return cv.getRectSubPix(cv.merge([img, img, img]), (patch_size, patch_size), center)[:, :, 0]
+    
+    return cv.getRectSubPix(img, (patch_size, patch_size), center)
+
+
+def get_reference_l1_norms(kps1, kps2, img1, img2, patch_size):
+    # get_L1_norm_for_kps as it was, one getRectSubPix per keypoint
+    mean_l1_norm = []
+    for kp1, kp2 in zip(kps1, kps2):
+        patch1 = get_rect_subpix(img1, patch_size, (kp1[0, 1], kp1[0, 0]))
+        patch2 = get_rect_subpix(img2, patch_size, (kp2[0, 1], kp2[0, 0]))
+        mean_l1_norm.append(np.mean(np.abs(patch1 - patch2)))
+        
+    return np.array(mean_l1_norm)
+
+
+def get_random_kps(rng, n, h, w, margin = -2):
+    # Sub-pixel (row, col) keypoints, the border included with a negative margin
+    kps = np.empty((n, 1, 2), dtype=np.float32)
+    kps[:, 0, 0] = rng.uniform(margin, h - margin, n)
+    kps[:, 0, 1] = rng.uniform(margin, w - margin, n)
+    return kps
+
+
+def test_gray_uint8_patches_match_the_getRectSubPix_loop():
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (120, 160), dtype=np.uint8)
+    
+    # Vectorized, away from the border
+    kps = get_random_kps(rng, 2000, 120, 160, margin = 8)
+    patches = get_subpix_patches(img, kps[:, 0, 1], kps[:, 0, 0], 5)
+    for patch, kp in zip(patches, kps):
+        np.testing.assert_array_equal(patch, get_rect_subpix(img, 5, (kp[0, 1], kp[0, 0])))
+        
+    # getRectSubPix on the gray image itself, within the rounding tolerance of get_subpix_patches
+    kps = get_random_kps(rng, 2000, 120, 160)
+    patches = get_subpix_patches(img, kps[:, 0, 1], kps[:, 0, 0], 5)
+    reference = np.stack([cv.getRectSubPix(img, (5, 5), (kp[0, 1], kp[0, 0])) for kp in kps])
+    diff = np.abs(patches.astype(int) - reference)
+    assert diff.max() <= 1
+    assert np.mean(diff) < 0.02
+
+
+def test_gray_uint8_l1_norms_match_getRectSubPix():
+    rng = np.random.default_rng(1)
+    img1 = rng.integers(0, 256, (120, 160), dtype=np.uint8)
+    img2 = rng.integers(0, 256, (120, 160), dtype=np.uint8)
+    kps1 = get_random_kps(rng, 2000, 120, 160, margin = 8)
+    kps2 = get_random_kps(rng, 2000, 120, 160, margin = 8)
+    
+    camera = StereoCamera()
+    for patch_size in (3, 7):
+        np.testing.assert_array_equal(camera.get_L1_norm_for_kps(kps1, kps2, img1, img2, patch_size = patch_size),
+                                      get_reference_l1_norms(kps1, kps2, img1, img2, patch_size))
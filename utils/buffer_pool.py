@@ -0,0 +1,36 @@
+import threading
+
+import numpy as np
+
+
+class BufferPool:
+    """Rotating sets of preallocated arrays, so per-frame outputs do not allocate.
+
+    Every (name, shape, dtype) gets `num_buffers` arrays that are handed out in turn, so an
+    array returned by get() is only overwritten `num_buffers` calls later.
+    """
+    def __init__(self, num_buffers = 2):
+        assert num_buffers >= 1, "The pool needs at least one buffer"
+        self.num_buffers = num_buffers
+
+        # (name, shape, dtype) -> [arrays, next position]
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+    def get(self, name, shape, dtype = np.float32):
+        key = (name, tuple(shape), np.dtype(dtype).str)
+
+        with self.lock:
+            entry = self.buffers.get(key)
+            if(entry is None):
+                entry = [[np.empty(shape, dtype=dtype) for _ in range(self.num_buffers)], 0]
+                self.buffers[key] = entry
+
+            arrays, position = entry
+            entry[1] = (position + 1) % self.num_buffers
+
+        return arrays[position]
+
+    def clear(self):
+        with self.lock:
+            self.buffers.clear()
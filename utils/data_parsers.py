@@ -1,13 +1,18 @@
 import json
 
-def get_frame_numbers_from_seq_control_file(filename : str):
+from cv_gui.utils.frame_plan import FramePlan
+
+def get_frame_plan_from_seq_control_file(filename : str):
     with open(filename) as f_in:
         data = json.load(f_in)
         
-    frame_numbers = []
-    critical_frame_sub_seq = data["critical_frames"]
-    
-    for critical_frames in critical_frame_sub_seq:
-        frame_numbers.extend(range(critical_frames[0], critical_frames[1], 1))
+    # Every critical frames entry is [start, stop] or [start, stop, stride]
+    segments = []
+    for critical_frames in data["critical_frames"]:
+        stride = critical_frames[2] if len(critical_frames) > 2 else 1
+        segments.append((critical_frames[0], critical_frames[1], stride))
         
-    return frame_numbers
\ No newline at end of file
+    return FramePlan(segments)
+
+def get_frame_numbers_from_seq_control_file(filename : str):
+    return list(get_frame_plan_from_seq_control_file(filename))
@@ -14,6 +14,8 @@ class IMAGE_TYPES(Enum):
     BGR = QImage.Format_BGR888 # The image is stored using a 24-bit BGR format (8-8-8).
     GRAY8 = QImage.Format_Grayscale8 # The image is stored using an 8-bit grayscale format. 
     GRAY16 = QImage.Format_Grayscale16 # The image is stored using an 16-bit grayscale format. 
+    BGRA = QImage.Format_RGB32 # The image is stored using a 32-bit format, B, G, R, A bytes on little-endian machines. Alpha is ignored.
+    RGBX = QImage.Format_RGBX8888 # The image is stored using a 32-bit byte-ordered RGB(x) format (8-8-8-8).
 
 class DATASET_TYPE(Enum):
     ZED = 0
@@ -25,4 +27,19 @@ class ERROR(Enum):
     NO_DATA_FOUND = 1,
     NO_FILE_FOUND = 2,
     END_OF_FILE = 3,
-    FAILURE = 4,
\ No newline at end of file
+    FAILURE = 4,
+    
+class QUEUE_POLICY(Enum):
+    BLOCK = 0 # The producer waits for room in the queue, no frame is lost
+    DROP_OLDEST = 1 # The oldest queued frame is dropped for the new one, for live cameras
+    
+class PROCESS_COMMAND(Enum):
+    PLAY = 0 # Play from the current frame
+    PAUSE = 1
+    SEEK = 2 # Go to a frame number, the last of a run of seeks wins
+    STEP = 3 # Move by a number of frames from the current one, a run of steps adds up
+    PREVIEW = 4 # Show the proxy of a frame number while scrubbing, without moving the camera
+    REFRESH = 5 # Send the current frame to the callbacks again, e.g. after a parameter change
+    STOP = 6
+    SAVE = 7 # Save an image of the frame on display, after the seeks queued before it
+    CALL = 8 # Run a function on the thread, e.g. a camera setter from the GUI, in order with the other commands
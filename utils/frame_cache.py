@@ -0,0 +1,79 @@
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+
+def get_frame_nbytes(frame):
+    # Only the arrays count towards the size of a frame. A LazyFrame only counts what it has produced
+    items = frame.loaded_items() if hasattr(frame, "loaded_items") else frame.items()
+    return sum(value.nbytes for _, value in items if isinstance(value, np.ndarray))
+
+
+class FrameCache:
+    """LRU cache of decoded frame dicts, capped by the total size of their arrays."""
+    def __init__(self, max_bytes = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        
+        self.frames = OrderedDict()
+        self.frame_sizes = {}
+        self.current_bytes = 0
+        
+        self.hits = 0
+        self.misses = 0
+        
+        self.lock = threading.Lock()
+        
+    def get(self, key):
+        with self.lock:
+            frame = self.frames.get(key)
+            if(frame is None):
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            self.frames.move_to_end(key)
+            return frame
+        
+    def put(self, key, frame):
+        nbytes = get_frame_nbytes(frame)
+        
+        with self.lock:
+            if(key in self.frames):
+                self._remove(key)
+                
+            # A frame bigger than the whole cache is never stored
+            if(nbytes > self.max_bytes):
+                return
+            
+            self.frames[key] = frame
+            self.frame_sizes[key] = nbytes
+            self.current_bytes += nbytes
+            
+            # Evict the least recently used frames
+            while(self.current_bytes > self.max_bytes):
+                self._remove(next(iter(self.frames)))
+                
+    def _remove(self, key):
+        self.frames.pop(key)
+        self.current_bytes -= self.frame_sizes.pop(key)
+        
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.frame_sizes.clear()
+            self.current_bytes = 0
+            
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        
+    def get_stats(self):
+        return {"hits": self.hits, "misses": self.misses, "frames": len(self.frames), 
+                "bytes": self.current_bytes, "max_bytes": self.max_bytes}
+    
+    def __len__(self):
+        return len(self.frames)
+    
+    def __contains__(self, key):
+        return key in self.frames
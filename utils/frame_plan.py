@@ -0,0 +1,110 @@
+from bisect import bisect_left, bisect_right
+
+
+class FramePlan:
+    """Frame numbers selected by a seq control file, kept as (start, stop, stride) segments.
+
+    Works like the list of every selected frame number with a read cursor: next() is O(1),
+    random access and the position of a frame number are O(log n) in the number of segments.
+    """
+    def __init__(self, segments = ()):
+        self.segments = []
+        for start, stop, stride in segments:
+            if(len(range(start, stop, stride)) > 0):
+                self.segments.append((start, stop, stride))
+
+        # Position of the first frame of every segment, plus the total
+        self.offsets = [0]
+        for start, stop, stride in self.segments:
+            self.offsets.append(self.offsets[-1] + len(range(start, stop, stride)))
+
+        # Increasing frame numbers allow finding a frame by bisection
+        self.firsts = [start for start, _, _ in self.segments]
+        self.lasts = [range(start, stop, stride)[-1] for start, stop, stride in self.segments]
+        self.increasing = all(stride > 0 for _, _, stride in self.segments) and \
+                          all(last < first for last, first in zip(self.lasts, self.firsts[1:]))
+
+        # Read cursor
+        self.position = 0
+        self.segment = 0
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __getitem__(self, position):
+        if(position < 0):
+            position += len(self)
+        if(not 0 <= position < len(self)):
+            raise IndexError("Frame plan position out of range")
+
+        segment = bisect_right(self.offsets, position) - 1
+        start, _, stride = self.segments[segment]
+
+        return start + (position - self.offsets[segment]) * stride
+
+    def __iter__(self):
+        for start, stop, stride in self.segments:
+            yield from range(start, stop, stride)
+
+    def index(self, frame_number):
+        # Position of frame_number in the plan, None if it is not selected
+        if(self.increasing):
+            segments = [bisect_right(self.firsts, frame_number) - 1]
+        else:
+            segments = range(len(self.segments))
+
+        for segment in segments:
+            if(segment < 0):
+                continue
+            frames = range(*self.segments[segment])
+            if(frame_number in frames):
+                return self.offsets[segment] + frames.index(frame_number)
+
+        return None
+
+    def is_exhausted(self):
+        return self.position >= len(self)
+
+    def peek(self, count = 1):
+        # Next `count` frame numbers without moving the cursor
+        return [self[position] for position in range(self.position, min(self.position + count, len(self)))]
+
+    def next(self):
+        # Frame number under the cursor and advance, None once the plan is exhausted
+        if(self.is_exhausted()):
+            return None
+
+        while(self.position >= self.offsets[self.segment + 1]):
+            self.segment += 1
+
+        start, _, stride = self.segments[self.segment]
+        frame_number = start + (self.position - self.offsets[self.segment]) * stride
+        self.position += 1
+
+        return frame_number
+
+    def seek(self, position):
+        self.position = min(max(position, 0), len(self))
+        self.segment = max(bisect_right(self.offsets, self.position) - 1, 0)
+        self.segment = min(self.segment, max(len(self.segments) - 1, 0))
+
+    def seek_after(self, frame_number):
+        """Move the cursor to the first planned frame after frame_number.
+
+        Plans that are not increasing have no such order, the cursor goes after frame_number if
+        it is planned and is left alone otherwise.
+        """
+        if(self.increasing):
+            segment = bisect_left(self.lasts, frame_number + 1)
+            if(segment == len(self.segments)):
+                self.seek(len(self))
+                return
+
+            start, _, stride = self.segments[segment]
+            steps = max(0, (frame_number - start) // stride + 1)
+            self.seek(self.offsets[segment] + steps)
+            return
+
+        position = self.index(frame_number)
+        if(position is not None):
+            self.seek(position + 1)
@@ -26,18 +26,23 @@ class Recorder:
         self.img3 = None
         self.timestamps = []
         
-    def save_figure(self, img_name, img_idx):
+    def save_figure(self, img_name, img_idx, img = None):
+        # img replaces the image on display, e.g. the full resolution one of a preview
         prefix = ""
         if(self.add_date_prefix_to_file_name):
             prefix = datetime.today().strftime("%Y%m%d") + "-"
             
-        if(img_idx == 1):
+        if(img is None and img_idx == 1):
             img = self.img1
-        if(img_idx == 2):
+        if(img is None and img_idx == 2):
             img = self.img2
-        if(img_idx == 3):
+        if(img is None and img_idx == 3):
             img = self.img3
             
+        if(img.ndim == 3 and img.shape[2] == 4):
+            # 32-bit BGRA frames (e.g. ZED), the alpha channel is not saved
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+            
         if(self.use_jpeg_file_ext):
             final_path = f"{self.save_dir_name}/{prefix}{img_name}.jpeg"
             cv2.imwrite(final_path, img)